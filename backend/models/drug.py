@@ -1,4 +1,5 @@
 from typing import Optional
+from datetime import datetime
 from sqlmodel import SQLModel, Field
 from pydantic import BaseModel
 
@@ -8,6 +9,15 @@ class Drug(SQLModel, table=True):
     stok: int
     harga: int
 
+class StockMovement(SQLModel, table=True):
+    """Append-only ledger of every change to Drug.stok."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    drug_id: int = Field(index=True)
+    change: int # Negative for stock leaving the pharmacy
+    reason: str # stok_awal, resep, penyesuaian
+    prescription_id: Optional[int] = Field(default=None, index=True)
+    created_at: datetime = Field(default_factory=datetime.now)
+
 class DrugCreate(BaseModel):
     nama: str
     stok: int
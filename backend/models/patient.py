@@ -1,4 +1,5 @@
 from typing import Optional
+from sqlalchemy import Index, func
 from sqlmodel import SQLModel, Field
 from pydantic import BaseModel
 
@@ -8,10 +9,13 @@ class Patient(SQLModel, table=True):
     name: str = Field(index=True)
     dob: str
     gender: str  # L or P
-    phone: str
+    phone: str = Field(index=True)
     address: str
     status: str  # menunggu, diperiksa, apotek, membayar, selesai
 
+# Patient lists sorted by medical record number, shorter numbers first (services.patient_search)
+Index("ix_patient_medicalrecordno_length", func.length(Patient.medicalRecordNo), Patient.medicalRecordNo)
+
 class PatientCreate(BaseModel):
     medicalRecordNo: Optional[str] = None
     name: str
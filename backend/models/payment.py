@@ -7,10 +7,11 @@ class Payment(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     patient_id: int = Field(index=True)
     examination_id: int = Field(index=True)
+    queue_entry_id: Optional[int] = Field(default=None, index=True) # The visit this payment settles
     drug_cost: int
     examination_fee: int
     total_amount: int
-    payment_date: datetime = Field(default_factory=datetime.now) # Use datetime object
+    payment_date: datetime = Field(default_factory=datetime.now, index=True) # Use datetime object
     method: str
     status: str
 
@@ -1,19 +1,59 @@
 from typing import Optional
 from sqlmodel import SQLModel, Field
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 from sqlmodel import SQLModel, Field
+from sqlalchemy import Index, text
 from datetime import datetime
 from pydantic import BaseModel # Keep BaseModel for QueueUpdateStatus
 
+# Entries not finished yet. Partial indexes over these rows stay as small as the
+# waiting room, however many completed visits the table holds; queries must
+# repeat the condition (services.queue_stats.active_queue_filter) to use them.
+ACTIVE_QUEUE_CONDITION = "status != 'selesai'"
+
 class QueueEntry(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_queueentry_doctor_id_status", "doctor_id", "status"), # Dashboard status counts
+        Index("ix_queueentry_active_status", "status", "doctor_id",
+              sqlite_where=text(ACTIVE_QUEUE_CONDITION), postgresql_where=text(ACTIVE_QUEUE_CONDITION)),
+        Index("ix_queueentry_active_doctor_id", "doctor_id",
+              sqlite_where=text(ACTIVE_QUEUE_CONDITION), postgresql_where=text(ACTIVE_QUEUE_CONDITION)),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     patient_id: int = Field(index=True)
     patient_name: str
     medicalRecordNo: Optional[str] = "RM000" # Consider if this should be directly from Patient model via relationship
     doctor_id: Optional[int] = Field(default=None, index=True)
     status: str # menunggu, diperiksa, apotek, membayar, selesai
-    created_at: datetime = Field(default_factory=datetime.now)
+    created_at: datetime = Field(default_factory=datetime.now, index=True)
+    status_changed_at: Optional[datetime] = None # Set by services.queue_workflow
+
+class QueueStatusTransition(SQLModel, table=True):
+    """
+    Append-only log of queue status changes, one row per change plus one for the
+    creation of the entry (from_status None). Written by services.queue_workflow.
+    """
+    __table_args__ = (
+        Index("ix_queuestatustransition_queue_entry_id_occurred_at", "queue_entry_id", "occurred_at"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    queue_entry_id: int
+    patient_id: int
+    doctor_id: Optional[int] = None
+    from_status: Optional[str] = None
+    to_status: str
+    occurred_at: datetime = Field(default_factory=datetime.now, index=True)
 
 class QueueUpdateStatus(BaseModel):
-    status: str
\ No newline at end of file
+    status: str
+
+class QueueTransitionRequest(BaseModel):
+    """Batch status change; at least one filter must be given."""
+    status: str
+    queue_ids: Optional[List[int]] = None
+    from_statuses: Optional[List[str]] = None
+    doctor_id: Optional[int] = None
+    created_before: Optional[datetime] = None
\ No newline at end of file
@@ -2,6 +2,7 @@ from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime
 from sqlmodel import SQLModel, Field
+from sqlalchemy import Index
 import json # Import json for serialization of ReportSummary
 
 class ReportSummary(BaseModel):
@@ -12,11 +13,16 @@ class ReportSummary(BaseModel):
     drugs_used: dict # {drug_name: quantity_used}
 
 class Report(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_report_type_period", "type", "period"), # Report lookup by (type, period)
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     generated_at: datetime = Field(default_factory=datetime.now)
     type: str = Field(index=True) # DAILY, MONTHLY
     period: str = Field(index=True) # YYYY-MM-DD or YYYY-MM
     summary: str # Storing ReportSummary as JSON string
+    provisional: bool = Field(default=False, sa_column_kwargs={"server_default": "0"}) # Period not closed yet, refreshed on regeneration
 
     # Helper methods to handle serialization/deserialization of summary
     def get_summary_obj(self) -> ReportSummary:
@@ -25,10 +31,23 @@ class Report(SQLModel, table=True):
     def set_summary_obj(self, summary_obj: ReportSummary):
         self.summary = summary_obj.json()
 
+class DailyReportRollup(SQLModel, table=True):
+    """Precomputed payment totals for one closed day, used to compose monthly reports."""
+    day: str = Field(primary_key=True) # YYYY-MM-DD
+    total_income: int
+    patient_ids: str # JSON list of distinct patient ids with a paid examination that day
+    drugs_used: str # JSON {drug_name: quantity_used}
+    computed_at: datetime = Field(default_factory=datetime.now)
+
 class Examination(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_examination_date_id", "date", "id"), # Keyset pagination of medical records
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     patient_id: int = Field(index=True)
     doctor_id: int = Field(index=True)
+    queue_entry_id: Optional[int] = Field(default=None, index=True) # The visit this examination belongs to
     complaint: str
     diagnosis: str
     notes: str
@@ -42,6 +61,10 @@ class ExaminationCreate(BaseModel):
     notes: str
 
 class Prescription(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_prescription_status_examination_id", "status", "examination_id"), # Pending bills / pharmacy worklist
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     examination_id: int = Field(index=True)
     drug_id: int = Field(index=True)
@@ -86,4 +109,6 @@ class MedicalRecordResponse(MedicalRecordBase):
 
 class MedicalRecordListResponse(BaseModel):
     records: List[MedicalRecordResponse]
-    total: int
\ No newline at end of file
+    total: int # Matching records for the filters, independent of the page
+    next_cursor: Optional[str] = None # Pass as `before` to get older records
+    prev_cursor: Optional[str] = None # Pass as `after` to get newer records
\ No newline at end of file
@@ -0,0 +1,6 @@
+from sqlmodel import SQLModel, Field
+
+class SequenceCounter(SQLModel, table=True):
+    """Named counters for generated numbers, e.g. medical record numbers."""
+    name: str = Field(primary_key=True)
+    value: int = 0 # Last value handed out (or reserved)
@@ -0,0 +1,6 @@
+from sqlmodel import SQLModel, Field
+
+class TableVersion(SQLModel, table=True):
+    """Change counter per table, bumped in the transaction of every write (services.table_versions)."""
+    table_name: str = Field(primary_key=True)
+    version: int = 0
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from typing import List, Optional, Dict
-from datetime import datetime, date
+from datetime import date
 
 from sqlmodel import Session, select, func # Import func for aggregation
 from sqlalchemy import text
@@ -10,6 +10,8 @@ from models.patient import Patient
 from models.queue import QueueEntry
 from models.payment import Payment
 from models.schedule import ScheduleEntry
+from services.queue_stats import get_queue_status_counts
+from utils.helpers import day_bounds, date_range_filter
 
 router = APIRouter(prefix="/admin", tags=["Admin"])
 
@@ -40,18 +42,15 @@ def get_admin_dashboard_summary(session: Session = Depends(get_session)):
     # 1. Patient Counts
     total_patients_all_time = session.exec(select(func.count(Patient.id))).one()
 
-    patients_today_count = session.exec(
-        select(func.count()).select_from(QueueEntry).where(func.date(QueueEntry.created_at) == today.isoformat())
-    ).one()
-
-    # 2. Active Queue Count
-    active_queue_count = session.exec(
-        select(func.count()).select_from(QueueEntry).where(QueueEntry.status != "selesai")
-    ).one()
+    # 2. Queue counts by status, today's registrations and active queue in one GROUP BY query
+    today_start, _ = day_bounds(today)
+    status_counts = get_queue_status_counts(session, since=today_start)
+    patients_today_count = status_counts.created_since
+    active_queue_count = status_counts.active
 
     # 3. Income Today
     income_today_result = session.exec(
-        select(func.sum(Payment.total_amount)).where(func.date(Payment.payment_date) == today.isoformat())
+        select(func.sum(Payment.total_amount)).where(*date_range_filter(Payment.payment_date, today, today))
     ).first()
     income_today = float(income_today_result) if income_today_result else 0.0
 
@@ -61,7 +60,8 @@ def get_admin_dashboard_summary(session: Session = Depends(get_session)):
         select(QueueEntry, Patient)
         .join(Patient, QueueEntry.patient_id == Patient.id)
         .order_by(QueueEntry.id.desc()) # Order by most recent queues (ID desc)
-    ).fetchmany(5)
+        .limit(5)
+    ).all()
 
     recent_queues = []
     for queue_entry, patient in recent_queues_db:
@@ -72,13 +72,8 @@ def get_admin_dashboard_summary(session: Session = Depends(get_session)):
             status=queue_entry.status
         ))
     
-    # 5. Queue Counts by Status
-    queue_counts = {
-        "menunggu": session.exec(select(func.count(QueueEntry.id)).where(QueueEntry.status == "menunggu")).one(),
-        "diperiksa": session.exec(select(func.count(QueueEntry.id)).where(QueueEntry.status == "diperiksa")).one(),
-        "membayar": session.exec(select(func.count(QueueEntry.id)).where(QueueEntry.status == "membayar")).one(),
-        "selesai": session.exec(select(func.count(QueueEntry.id)).where(QueueEntry.status == "selesai")).one(),
-    }
+    # 5. Queue Counts by Status (computed above)
+    queue_counts = status_counts.total
 
     # 6. Doctor Schedules
     doctor_schedules = session.exec(select(ScheduleEntry)).all()
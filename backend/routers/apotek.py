@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 from typing import List
 from sqlmodel import Session, select
@@ -6,6 +6,9 @@ from database import get_session
 from models.report import Prescription, Examination
 from models.patient import Patient
 from models.queue import QueueEntry
+from services.medical_records import fetch_visit_queue_entries
+from services.queue_workflow import QueueWorkflowError, transition_queue_entry, publish_transitions
+from services.queue_stats import active_queue_filter
 
 router = APIRouter(prefix="/apotek", tags=["Apotek"])
 
@@ -18,43 +21,35 @@ class PendingPatientResponse(BaseModel):
 @router.get("/pending-patients", response_model=List[PendingPatientResponse])
 def get_pending_patients(session: Session = Depends(get_session)):
     """Get patients with pending prescriptions that need to be fulfilled"""
-    # Get all prescriptions with 'menunggu' status
-    pending_prescriptions = session.exec(
-        select(Prescription).where(Prescription.status == "menunggu")
+    # Pending prescriptions with their examination and patient in one joined query
+    # (served by the (status, examination_id) index on Prescription)
+    pending_rows = session.exec(
+        select(Prescription, Examination, Patient)
+        .join(Examination, Examination.id == Prescription.examination_id)
+        .join(Patient, Patient.id == Examination.patient_id)
+        .where(Prescription.status == "menunggu")
+        .order_by(Prescription.id)
     ).all()
 
     # Group prescriptions by examination_id
-    from collections import defaultdict
-    prescription_groups = defaultdict(list)
-    for pres in pending_prescriptions:
-        prescription_groups[pres.examination_id].append(pres)
+    groups = {}
+    for pres, examination, patient in pending_rows:
+        if examination.id not in groups:
+            groups[examination.id] = (examination, patient, [])
+        groups[examination.id][2].append(pres)
 
-    result = []
-    for exam_id, prescriptions in prescription_groups.items():
-        # Get examination
-        examination = session.exec(
-            select(Examination).where(Examination.id == exam_id)
-        ).first()
-
-        if examination:
-            # Get patient
-            patient = session.exec(
-                select(Patient).where(Patient.id == examination.patient_id)
-            ).first()
-
-            if patient:
-                # Get current queue status
-                queue_entry = session.exec(
-                    select(QueueEntry).where(QueueEntry.patient_id == patient.id)
-                    .order_by(QueueEntry.id.desc())
-                ).first()
+    # Current queue status: the visit of each examination, fetched by primary key
+    visit_queue_entries = fetch_visit_queue_entries(session, [examination for examination, _, _ in groups.values()])
 
-                result.append(PendingPatientResponse(
-                    patient=patient,
-                    examination=examination,
-                    prescriptions=prescriptions,
-                    queue_status=queue_entry.status if queue_entry else "unknown"
-                ))
+    result = []
+    for examination, patient, prescriptions in groups.values():
+        queue_entry = visit_queue_entries.get(examination.id)
+        result.append(PendingPatientResponse(
+            patient=patient,
+            examination=examination,
+            prescriptions=prescriptions,
+            queue_status=queue_entry.status if queue_entry else "unknown"
+        ))
 
     return result
 
@@ -62,7 +57,7 @@ def get_pending_patients(session: Session = Depends(get_session)):
 def get_apotek_queue(session: Session = Depends(get_session)):
     """Get all queue entries for apotek (patients with 'apotek' status)"""
     queue_entries = session.exec(
-        select(QueueEntry).where(QueueEntry.status == "apotek")
+        select(QueueEntry).where(QueueEntry.status == "apotek").where(active_queue_filter())
     ).all()
 
     return queue_entries
@@ -70,25 +65,14 @@ def get_apotek_queue(session: Session = Depends(get_session)):
 @router.patch("/{queue_id}/set-apotek-status", response_model=QueueEntry)
 def set_apotek_status(queue_id: int, session: Session = Depends(get_session)):
     """Manually set queue status to 'apotek' (for cases where status flow needs correction)"""
-    from models.patient import Patient
-    queue_entry = session.exec(select(QueueEntry).where(QueueEntry.id == queue_id)).first()
-    if not queue_entry:
-        from fastapi import HTTPException
-        raise HTTPException(status_code=404, detail="Queue entry not found")
-
-    # Update queue status to 'apotek'
-    queue_entry.status = "apotek"
-    session.add(queue_entry)
-
-    # Update patient status to 'apotek' as well
-    patient = session.exec(select(Patient).where(Patient.id == queue_entry.patient_id)).first()
-    if patient:
-        patient.status = "apotek"
-        session.add(patient)
+    try:
+        # A correction may move the visit from any status
+        queue_entry, transition = transition_queue_entry(session, queue_id, "apotek", True)
+    except QueueWorkflowError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
 
     session.commit()
     session.refresh(queue_entry)
-    if patient:
-        session.refresh(patient)
+    publish_transitions([transition])
 
-    return queue_entry
\ No newline at end of file
+    return queue_entry
@@ -2,12 +2,15 @@ from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from typing import List, Dict, Any
 from sqlmodel import Session, select
+from sqlalchemy import and_, exists
 from database import get_session
 from models.report import Prescription # Assuming Prescription is now in its own file
 from models.payment import Payment
 from models.report import Examination # Examination is in report.py
 from models.patient import Patient
 from models.drug import Drug
+from models.queue import QueueEntry
+from services.queue_stats import active_queue_filter
 
 router = APIRouter(prefix="/bills", tags=["Bills"])
 
@@ -24,52 +27,44 @@ class PendingBill(BaseModel):
 
 @router.get("/pending", response_model=List[PendingBill])
 def get_pending_bills(session: Session = Depends(get_session)):
-    prescriptions = session.exec(select(Prescription)).all()
-    payments = session.exec(select(Payment)).all()
-    examinations = session.exec(select(Examination)).all()
-    patients = session.exec(select(Patient)).all()
-    drugs = session.exec(select(Drug)).all()
-
-    # Create dictionaries for faster lookup
-    patient_map = {p.id: p for p in patients}
-    drug_map = {d.id: d for d in drugs}
-    examination_map = {e.id: e for e in examinations}
-    paid_examination_ids = {p.examination_id for p in payments}
-    
-    pending_prescriptions = [
-        p for p in prescriptions if p.status == "selesai" and p.examination_id not in paid_examination_ids
-    ]
+    # Bills come from the visits waiting at the cashier ("membayar"), read from the
+    # partial active-queue indexes, so the cost follows the open visits instead of
+    # every prescription ever fulfilled. Their examinations are found through
+    # Examination.queue_entry_id, their fulfilled prescriptions through the
+    # (status, examination_id) index, and paid examinations are left out.
+    unpaid = ~exists().where(Payment.examination_id == Examination.id)
+    rows = session.exec(
+        select(Examination.id, Patient.id, Patient.name, Prescription.quantity, Drug.nama, Drug.harga)
+        .select_from(QueueEntry)
+        .join(Examination, Examination.queue_entry_id == QueueEntry.id)
+        .join(Patient, Patient.id == Examination.patient_id)
+        .join(Prescription, and_(Prescription.examination_id == Examination.id, Prescription.status == "selesai"))
+        .outerjoin(Drug, Drug.id == Prescription.drug_id)
+        .where(QueueEntry.status == "membayar")
+        .where(active_queue_filter())
+        .where(unpaid)
+        .order_by(Examination.id, Prescription.id)
+    ).all()
 
     bills = {}
-    for pres in pending_prescriptions:
-        exam_id = pres.examination_id
+    for exam_id, patient_id, patient_name, quantity, drug_name, drug_price in rows:
         if exam_id not in bills:
-            
-            exam = examination_map.get(exam_id)
-            if not exam:
-                continue
-
-            patient = patient_map.get(exam.patient_id)
-            if not patient:
-                continue
-
             bills[exam_id] = {
                 "examination_id": exam_id,
-                "patient_id": patient.id,
-                "patient_name": patient.name,
+                "patient_id": patient_id,
+                "patient_name": patient_name,
                 "drug_cost": 0,
                 "examination_fee": EXAMINATION_FEE,
                 "details": []
             }
 
-        drug = drug_map.get(pres.drug_id)
-        if drug:
-            cost = pres.quantity * drug.harga
+        if drug_name is not None:
+            cost = quantity * drug_price
             bills[exam_id]["drug_cost"] += cost
             bills[exam_id]["details"].append({
-                "drug_name": drug.nama,
-                "quantity": pres.quantity,
-                "price_per_unit": drug.harga,
+                "drug_name": drug_name,
+                "quantity": quantity,
+                "price_per_unit": drug_price,
                 "total_cost": cost
             })
 
@@ -1,14 +1,19 @@
 from fastapi import APIRouter, HTTPException, Query, Depends
 from typing import List, Optional
-from datetime import datetime
+from datetime import date
+from collections import defaultdict
 from pydantic import BaseModel
 
-from sqlmodel import Session, select, func
+from sqlmodel import Session, select, func, and_, case, true
 from database import get_session
-from models.report import Examination, ExaminationCreate, MedicalRecordResponse, MedicalRecordListResponse, Prescription, PatientInfo, DoctorInfo
+from models.report import Examination, ExaminationCreate, MedicalRecordListResponse
 from models.queue import QueueEntry
 from models.patient import Patient
 from models.employee import Employee
+from services.medical_records import get_medical_record_page
+from services.queue_stats import get_queue_status_counts
+from services.queue_workflow import transition_entry, publish_transitions
+from utils.helpers import date_range_filter
 
 router = APIRouter(prefix="/doctors", tags=["Doctors"])
 
@@ -29,27 +34,9 @@ class DashboardSummary(BaseModel):
 
 @router.get("/dashboard-summary", response_model=DashboardSummary)
 def get_dashboard_summary(doctor_id: int = Query(...), session: Session = Depends(get_session)):
-    # Count waiting queues for this doctor
-    waiting_count = session.exec(
-        select(func.count()).select_from(QueueEntry).where(QueueEntry.status == "menunggu").where(QueueEntry.doctor_id == doctor_id)
-    ).one()
-    # Count in-progress queues for this doctor
-    in_progress_count = session.exec(
-        select(func.count()).select_from(QueueEntry).where(QueueEntry.status == "diperiksa").where(QueueEntry.doctor_id == doctor_id)
-    ).one()
-    # Count pharmacy queues
-    pharmacy_count = session.exec(
-        select(func.count()).select_from(QueueEntry).where(QueueEntry.status == "apotek").where(QueueEntry.doctor_id == doctor_id)
-    ).one()
-    # Count payment pending queues for this doctor
-    payment_pending_count = session.exec(
-        select(func.count()).select_from(QueueEntry).where(QueueEntry.status == "membayar").where(QueueEntry.doctor_id == doctor_id)
-    ).one()
-    # Count completed queues for this doctor
-    completed_count = session.exec(
-        select(func.count()).select_from(QueueEntry).where(QueueEntry.status == "selesai").where(QueueEntry.doctor_id == doctor_id)
-    ).one()
-    
+    # All per-status counts for this doctor in one GROUP BY query
+    status_counts = get_queue_status_counts(session, doctor_id=doctor_id).total
+
     # Latest examination for the doctor
     latest_exam_with_patient = session.exec(
         select(Examination, Patient)
@@ -69,11 +56,11 @@ def get_dashboard_summary(doctor_id: int = Query(...), session: Session = Depend
         )
         
     return DashboardSummary(
-        waiting_count=waiting_count,
-        in_progress_count=in_progress_count,
-        pharmacy_count=pharmacy_count,
-        payment_pending_count=payment_pending_count,
-        completed_count=completed_count,
+        waiting_count=status_counts["menunggu"],
+        in_progress_count=status_counts["diperiksa"],
+        pharmacy_count=status_counts["apotek"],
+        payment_pending_count=status_counts["membayar"],
+        completed_count=status_counts["selesai"],
         latest_examination=latest_exam_summary
     )
 
@@ -87,186 +74,136 @@ def create_examination_record(payload: ExaminationCreate, session: Session = Dep
     new_examination = Examination(
         patient_id=queue_entry.patient_id,
         doctor_id=payload.doctor_id,
+        queue_entry_id=queue_entry.id,
         complaint=payload.complaint,
         diagnosis=payload.diagnosis,
         notes=payload.notes,
         # date will be set by default_factory in the model
     )
     session.add(new_examination)
-    # Update queue status to 'apotek' after examination (goes to pharmacy)
-    queue_entry.status = "apotek"
-    session.add(queue_entry)
-    # Also update patient status to 'apotek'
-    patient = session.exec(select(Patient).where(Patient.id == queue_entry.patient_id)).first()
-    if patient:
-        patient.status = "apotek"
-        session.add(patient)
+    # The visit goes to the pharmacy after the examination, unless it is already finished
+    transition = transition_entry(session, queue_entry, "apotek", strict=False)
     session.commit()
     session.refresh(new_examination)
-    session.refresh(queue_entry)
+    publish_transitions([transition])
     return new_examination
 
 # --- Performance Tracking ---
+class DailyPatientCount(BaseModel):
+    date: str
+    count: int
+
 class DoctorPerformance(BaseModel):
     doctor_id: int
     doctor_name: str
     total_patients: int
     daily_patients: int # Patients handled today
+    period_patients: Optional[int] = None # Patients handled in date_from..date_to, if requested
+    daily_breakdown: List[DailyPatientCount] = [] # Per-day counts in date_from..date_to, if requested
 
 @router.get("/performance", response_model=List[DoctorPerformance])
-def get_doctor_performance(session: Session = Depends(get_session)):
-    from models.employee import Employee # Import here to avoid circular dependency if any
-    
-    # Get all doctors
-    doctors = session.exec(select(Employee).where(Employee.role == "dokter")).all()
-    
-    performance_list = []
-    for doctor in doctors:
-        # Total patients (completed queues)
-        total_patients = session.exec(
-            select(func.count()).select_from(QueueEntry)
-            .where(QueueEntry.doctor_id == doctor.id)
-            .where(QueueEntry.status == "selesai")
-        ).one()
-        
-        # Daily patients (completed queues today)
-        today = datetime.now().date()
-        daily_patients = session.exec(
-            select(func.count()).select_from(QueueEntry)
-            .where(QueueEntry.doctor_id == doctor.id)
+def get_doctor_performance(
+    date_from: Optional[date] = Query(None, description="Inclusive, YYYY-MM-DD"),
+    date_to: Optional[date] = Query(None, description="Inclusive, YYYY-MM-DD"),
+    session: Session = Depends(get_session)
+):
+    today = date.today()
+    has_period = date_from is not None or date_to is not None
+
+    # Completed queues per doctor: all-time, today and (optionally) in the requested period,
+    # as conditional sums over one GROUP BY instead of two COUNT queries per doctor
+    is_today = and_(*date_range_filter(QueueEntry.created_at, today, today))
+    period_conditions = date_range_filter(QueueEntry.created_at, date_from, date_to)
+    in_period = and_(*period_conditions) if period_conditions else true()
+
+    rows = session.exec(
+        select(
+            Employee.id,
+            Employee.name,
+            func.count(QueueEntry.id),
+            func.coalesce(func.sum(case((is_today, 1), else_=0)), 0),
+            func.coalesce(func.sum(case((in_period, 1), else_=0)), 0),
+        )
+        .select_from(Employee)
+        .outerjoin(QueueEntry, and_(QueueEntry.doctor_id == Employee.id, QueueEntry.status == "selesai"))
+        .where(Employee.role == "dokter")
+        .group_by(Employee.id, Employee.name)
+        .order_by(Employee.id)
+    ).all()
+
+    # Per-day breakdown for the requested period, grouped in SQL
+    breakdown = defaultdict(list)
+    if has_period:
+        day = func.date(QueueEntry.created_at)
+        breakdown_query = (
+            select(QueueEntry.doctor_id, day, func.count())
             .where(QueueEntry.status == "selesai")
-            .where(func.date(QueueEntry.created_at) == str(today))
-        ).one()
-        
-        performance_list.append(DoctorPerformance(
-            doctor_id=doctor.id,
-            doctor_name=doctor.name,
+            .where(QueueEntry.doctor_id.is_not(None))
+        )
+        if period_conditions:
+            breakdown_query = breakdown_query.where(*period_conditions)
+        for doctor_id, visit_date, count in session.exec(
+            breakdown_query.group_by(QueueEntry.doctor_id, day).order_by(QueueEntry.doctor_id, day)
+        ).all():
+            breakdown[doctor_id].append(DailyPatientCount(date=str(visit_date), count=count))
+
+    return [
+        DoctorPerformance(
+            doctor_id=doctor_id,
+            doctor_name=doctor_name,
             total_patients=total_patients,
-            daily_patients=daily_patients
-        ))
-
-    return performance_list
+            daily_patients=daily_patients,
+            period_patients=period_patients if has_period else None,
+            daily_breakdown=breakdown.get(doctor_id, [])
+        )
+        for doctor_id, doctor_name, total_patients, daily_patients, period_patients in rows
+    ]
 
 
 @router.get("/medical-records/my-patients", response_model=MedicalRecordListResponse)
 def get_medical_records_for_my_patients(
     doctor_id: int = Query(...),
+    patient_id: Optional[int] = Query(None),
+    date_from: Optional[date] = Query(None, description="Inclusive, YYYY-MM-DD"),
+    date_to: Optional[date] = Query(None, description="Inclusive, YYYY-MM-DD"),
+    diagnosis: Optional[str] = Query(None, description="Case-insensitive substring match"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Page size; all records when omitted"),
+    before: Optional[str] = Query(None, description="Cursor from next_cursor"),
+    after: Optional[str] = Query(None, description="Cursor from prev_cursor"),
     session: Session = Depends(get_session)
 ):
     """
     Get medical records for patients examined by the specified doctor
     """
-    # Get examinations by this doctor with patient and doctor details
-    examinations = session.exec(
-        select(Examination)
-        .where(Examination.doctor_id == doctor_id)
-        .order_by(Examination.date.desc())
-    ).all()
-
-    records = []
-    for exam in examinations:
-        # Get patient info
-        patient = session.exec(
-            select(Patient).where(Patient.id == exam.patient_id)
-        ).first()
-
-        # Get doctor info
-        doctor = session.exec(
-            select(Employee).where(Employee.id == exam.doctor_id)
-        ).first()
-
-        # Get prescriptions for this examination
-        prescriptions = session.exec(
-            select(Prescription).where(Prescription.examination_id == exam.id)
-        ).all()
-
-        record = MedicalRecordResponse(
-            id=exam.id,
-            patient_id=exam.patient_id,
-            complaint=exam.complaint,
-            diagnosis=exam.diagnosis,
-            notes=exam.notes,
-            date=exam.date,
-            patient=PatientInfo(
-                id=patient.id,
-                medicalRecordNo=patient.medicalRecordNo,
-                name=patient.name,
-                dob=patient.dob,
-                gender=patient.gender,
-                phone=patient.phone,
-                address=patient.address
-            ) if patient else None,
-            doctor=DoctorInfo(
-                id=doctor.id,
-                name=doctor.name
-            ) if doctor else None,
-            prescriptions=prescriptions
+    try:
+        return get_medical_record_page(
+            session, doctor_id=doctor_id, patient_id=patient_id, date_from=date_from, date_to=date_to,
+            diagnosis=diagnosis, limit=limit, before=before, after=after
         )
-        records.append(record)
-
-    return MedicalRecordListResponse(
-        records=records,
-        total=len(records)
-    )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.get("/medical-records/all", response_model=MedicalRecordListResponse)
 def get_all_medical_records(
     doctor_id: int = Query(...),
+    patient_id: Optional[int] = Query(None),
+    date_from: Optional[date] = Query(None, description="Inclusive, YYYY-MM-DD"),
+    date_to: Optional[date] = Query(None, description="Inclusive, YYYY-MM-DD"),
+    diagnosis: Optional[str] = Query(None, description="Case-insensitive substring match"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Page size; all records when omitted"),
+    before: Optional[str] = Query(None, description="Cursor from next_cursor"),
+    after: Optional[str] = Query(None, description="Cursor from prev_cursor"),
     session: Session = Depends(get_session)
 ):
     """
     Get all medical records (for authorized doctors)
     Note: This endpoint should be used with proper authorization in production
     """
-    # Get all examinations ordered by date (newest first)
-    examinations = session.exec(
-        select(Examination)
-        .order_by(Examination.date.desc())
-    ).all()
-
-    records = []
-    for exam in examinations:
-        # Get patient info
-        patient = session.exec(
-            select(Patient).where(Patient.id == exam.patient_id)
-        ).first()
-
-        # Get doctor info
-        doctor = session.exec(
-            select(Employee).where(Employee.id == exam.doctor_id)
-        ).first()
-
-        # Get prescriptions for this examination
-        prescriptions = session.exec(
-            select(Prescription).where(Prescription.examination_id == exam.id)
-        ).all()
-
-        record = MedicalRecordResponse(
-            id=exam.id,
-            patient_id=exam.patient_id,
-            complaint=exam.complaint,
-            diagnosis=exam.diagnosis,
-            notes=exam.notes,
-            date=exam.date,
-            patient=PatientInfo(
-                id=patient.id,
-                medicalRecordNo=patient.medicalRecordNo,
-                name=patient.name,
-                dob=patient.dob,
-                gender=patient.gender,
-                phone=patient.phone,
-                address=patient.address
-            ) if patient else None,
-            doctor=DoctorInfo(
-                id=doctor.id,
-                name=doctor.name
-            ) if doctor else None,
-            prescriptions=prescriptions
+    try:
+        return get_medical_record_page(
+            session, patient_id=patient_id, date_from=date_from, date_to=date_to,
+            diagnosis=diagnosis, limit=limit, before=before, after=after
         )
-        records.append(record)
-
-    return MedicalRecordListResponse(
-        records=records,
-        total=len(records)
-    )
\ No newline at end of file
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
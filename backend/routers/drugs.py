@@ -3,6 +3,9 @@ from typing import List
 from sqlmodel import Session, select
 from database import get_session
 from models.drug import Drug, DrugCreate, DrugUpdateStock, DrugUpdate # Drug is now SQLModel
+from services.drug_catalogue import drug_catalogue
+from services import stock_ledger
+from services.table_versions import conditional_get
 
 router = APIRouter(prefix="/drugs", tags=["Drugs"])
 
@@ -11,29 +14,33 @@ def create_drug(drug_create: DrugCreate, session: Session = Depends(get_session)
     new_drug = Drug.from_orm(drug_create) # Create Drug instance from DrugCreate Pydantic model
     
     session.add(new_drug)
+    session.flush() # Assign the id for the ledger entry
+    stock_ledger.record_initial_stock(session, new_drug)
     session.commit()
     session.refresh(new_drug)
     
     return new_drug
 
-@router.get("/", response_model=List[Drug])
+@router.get("/", response_model=List[Drug], dependencies=[Depends(conditional_get(Drug))])
 def get_drugs(session: Session = Depends(get_session)):
     drugs = session.exec(select(Drug)).all()
     return drugs
 
+@router.get("/cache-stats")
+def get_drug_cache_stats():
+    """Hit/miss counters of the in-process drug catalogue cache"""
+    return drug_catalogue.stats()
+
 @router.patch("/{drug_id}/stock", response_model=Drug)
 def update_drug_stock(drug_id: int, drug_update: DrugUpdateStock, session: Session = Depends(get_session)):
-    drug = session.exec(select(Drug).where(Drug.id == drug_id)).first()
-    if not drug:
-        raise HTTPException(status_code=404, detail="Drug not found")
-    
-    drug.stok += drug_update.change_amount
-    if drug.stok < 0:
-        drug.stok = 0 # Prevent negative stock
-    
-    session.add(drug)
+    # Atomic increment/decrement in SQL, clamped at zero to prevent negative stock
+    try:
+        stock_ledger.adjust_stock(session, drug_id, drug_update.change_amount)
+    except stock_ledger.StockLedgerError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
     session.commit()
-    session.refresh(drug)
+    drug = session.get(Drug, drug_id)
     
     return drug
 
@@ -46,7 +53,7 @@ def update_drug(drug_id: int, drug_update: DrugUpdate, session: Session = Depend
     if drug_update.nama is not None:
         drug.nama = drug_update.nama
     if drug_update.stok is not None:
-        drug.stok = drug_update.stok
+        stock_ledger.set_stock(session, drug_id, drug_update.stok)
     if drug_update.harga is not None:
         drug.harga = drug_update.harga
     
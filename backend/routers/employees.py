@@ -3,10 +3,11 @@ from typing import List
 from sqlmodel import Session, select
 from database import get_session
 from models.employee import Employee # Employee is now SQLModel
+from services.table_versions import conditional_get
 
 router = APIRouter(prefix="/employees", tags=["Employees"])
 
-@router.get("/", response_model=List[Employee])
+@router.get("/", response_model=List[Employee], dependencies=[Depends(conditional_get(Employee))])
 def get_employees(session: Session = Depends(get_session)):
     employees = session.exec(select(Employee)).all()
     return employees
@@ -1,16 +1,24 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
 from pydantic import BaseModel
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, date, timedelta
 
 from sqlmodel import Session, select, func
+from fastapi.concurrency import run_in_threadpool
 from database import get_session
 from models.patient import Patient, PatientCreate, PatientUpdate
 from models.queue import QueueEntry
-from models.report import Examination, Prescription # Examination and Prescription are in report.py
-from models.drug import Drug
+from models.report import Examination # Examination is in report.py
 from models.payment import Payment
-from models.employee import Employee
+from services.medical_records import fetch_prescriptions_by_examination, fetch_doctors_by_id
+from services.drug_catalogue import drug_catalogue
+from services.queue_events import queue_event, queue_event_bus
+from services.queue_workflow import record_queue_entry_created
+from services.table_versions import conditional_get
+from services.patient_search import patient_filters, count_patients, get_patient_page, search_patients
+from services.record_numbers import next_medical_record_no
+from services.patient_import import PatientImportError, parse_patient_rows, validate_patient_rows, import_patients
+from utils.helpers import date_range_filter, add_months
 
 router = APIRouter(prefix="/patients", tags=["Patients"])
 
@@ -57,11 +65,14 @@ class PatientStats(BaseModel):
 
 @router.get("/stats", response_model=PatientStats)
 def get_patient_stats(session: Session = Depends(get_session)):
+    today = date.today()
+
     # Daily visits (last 7 days)
-    # Note: SQLite specific date function
+    # Note: SQLite specific date function for the grouping; the range itself is a
+    # plain comparison on the indexed created_at column
     daily_results = session.exec(
         select(func.strftime('%Y-%m-%d', QueueEntry.created_at), func.count(QueueEntry.id))
-        .where(func.date(QueueEntry.created_at) >= func.date('now', '-7 days'))
+        .where(*date_range_filter(QueueEntry.created_at, today - timedelta(days=7), None))
         .group_by(func.strftime('%Y-%m-%d', QueueEntry.created_at))
         .order_by(func.strftime('%Y-%m-%d', QueueEntry.created_at))
     ).all()
@@ -69,7 +80,7 @@ def get_patient_stats(session: Session = Depends(get_session)):
     # Monthly visits (last 6 months)
     monthly_results = session.exec(
         select(func.strftime('%Y-%m', QueueEntry.created_at), func.count(QueueEntry.id))
-        .where(func.date(QueueEntry.created_at) >= func.date('now', '-6 months'))
+        .where(*date_range_filter(QueueEntry.created_at, add_months(today, -6), None))
         .group_by(func.strftime('%Y-%m', QueueEntry.created_at))
         .order_by(func.strftime('%Y-%m', QueueEntry.created_at))
     ).all()
@@ -79,11 +90,45 @@ def get_patient_stats(session: Session = Depends(get_session)):
         monthly_visits=[VisitStats(date=r[0], count=r[1]) for r in monthly_results]
     )
 
-@router.get("/", response_model=List[Patient])
-def get_patients(session: Session = Depends(get_session)):
-    patients = session.exec(select(Patient)).all()
+@router.get("/", response_model=List[Patient], dependencies=[Depends(conditional_get(Patient))])
+def get_patients(
+    response: Response,
+    session: Session = Depends(get_session),
+    name: Optional[str] = Query(None, description="Name prefix"),
+    medicalRecordNo: Optional[str] = Query(None, description="Medical record number prefix, e.g. RM01"),
+    phone: Optional[str] = Query(None, description="Phone number prefix"),
+    sort: str = Query("id", description="id, name or medicalRecordNo"),
+    order: str = Query("asc", description="asc or desc"),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    after: Optional[str] = Query(None, description="Cursor from the X-Next-Cursor header")
+):
+    """
+    Without `limit` all matching patients are returned. With `limit` the response
+    is one page: X-Total-Count holds the number of matches and X-Next-Cursor the
+    cursor for `after` when there is a next page.
+    """
+    filters = patient_filters(name, medicalRecordNo, phone)
+    try:
+        patients, next_cursor = get_patient_page(session, filters, sort, order, limit, offset, after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if limit is not None:
+        response.headers["X-Total-Count"] = str(count_patients(session, filters))
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
     return patients
 
+@router.get("/search", response_model=List[Patient])
+def search_patient_directory(
+    q: str = Query(..., min_length=1, description="Part of a name, address, phone or medical record number; typos are tolerated"),
+    limit: int = Query(20, ge=1, le=100),
+    session: Session = Depends(get_session)
+):
+    """Patients ranked by match quality: substring matches first, then similar spellings"""
+    return search_patients(session, q, limit)
+
 @router.get("/{patient_id}/history", response_model=PatientHistory)
 def get_patient_history(patient_id: int, session: Session = Depends(get_session)):
     patient_info = session.exec(select(Patient).where(Patient.id == patient_id)).first()
@@ -94,15 +139,16 @@ def get_patient_history(patient_id: int, session: Session = Depends(get_session)
     patient_examinations = session.exec(
         select(Examination).where(Examination.patient_id == patient_id).order_by(Examination.date.desc())
     ).all()
-    examinations_with_details = []
+    # Batch-load prescriptions, drugs and doctors for all examinations at once
+    prescriptions_by_exam = fetch_prescriptions_by_examination(session, (e.id for e in patient_examinations))
+    drug_map = drug_catalogue.by_id(session)
+    doctor_map = fetch_doctors_by_id(session, (e.doctor_id for e in patient_examinations))
 
+    examinations_with_details = []
     for exam in patient_examinations:
-        exam_prescriptions = session.exec(
-            select(Prescription).where(Prescription.examination_id == exam.id)
-        ).all()
         prescriptions_details = []
-        for pres in exam_prescriptions:
-            drug_info = session.exec(select(Drug).where(Drug.id == pres.drug_id)).first()
+        for pres in prescriptions_by_exam.get(exam.id, []):
+            drug_info = drug_map.get(pres.drug_id)
             prescriptions_details.append(PrescriptionDetail(
                 drug_name=drug_info.nama if drug_info else "Unknown Drug",
                 quantity=pres.quantity,
@@ -110,7 +156,7 @@ def get_patient_history(patient_id: int, session: Session = Depends(get_session)
             ))
 
         # Get doctor info
-        doctor_info = session.exec(select(Employee).where(Employee.id == exam.doctor_id)).first()
+        doctor_info = doctor_map.get(exam.doctor_id)
         doctor_data = DoctorInfo(
             id=doctor_info.id if doctor_info else exam.doctor_id,
             name=doctor_info.name if doctor_info else "Dokter Tidak Diketahui"
@@ -146,20 +192,8 @@ def get_patient_history(patient_id: int, session: Session = Depends(get_session)
 
 @router.post("/", response_model=Patient)
 def register_patient(patient_create: PatientCreate, session: Session = Depends(get_session)):
-    # --- Auto-generate Medical Record Number ---
-    # Find the highest existing MRN number
-    last_patient = session.exec(select(Patient).order_by(Patient.id.desc())).first()
-    if last_patient and last_patient.medicalRecordNo:
-        try:
-            highest_mrn = int(last_patient.medicalRecordNo[2:])
-        except (ValueError, TypeError):
-            highest_mrn = 0 # Fallback if malformed
-    else:
-        highest_mrn = 0
-    
-    next_mrn_number = highest_mrn + 1
-    new_medical_record_no = f"RM{next_mrn_number:03d}"
-    # -----------------------------------------
+    # Allocated from the medical record sequence, without reading Patient
+    new_medical_record_no = next_medical_record_no(session)
 
     # Create new Patient
     new_patient = Patient(
@@ -172,8 +206,7 @@ def register_patient(patient_create: PatientCreate, session: Session = Depends(g
         address=patient_create.address
     )
     session.add(new_patient)
-    session.commit()
-    session.refresh(new_patient) # To get the auto-generated ID
+    session.flush() # Assigns the patient id for the queue entry
 
     # Create new QueueEntry
     new_queue_entry = QueueEntry(
@@ -184,10 +217,33 @@ def register_patient(patient_create: PatientCreate, session: Session = Depends(g
         status="menunggu"
     )
     session.add(new_queue_entry)
+    session.flush() # Assigns the queue entry id for the event
+    record_queue_entry_created(session, new_queue_entry)
+
+    # Everything the response and the event need is known now, so both are built
+    # before the single commit and nothing is reloaded afterwards
+    registered_patient = Patient(**new_patient.model_dump())
+    created_event = queue_event("created", new_queue_entry)
     session.commit()
-    session.refresh(new_queue_entry) # To get the auto-generated ID
-    
-    return new_patient
+    queue_event_bus.publish(created_event)
+
+    return registered_patient
+
+@router.post("/import")
+async def import_patient_file(request: Request, session: Session = Depends(get_session)):
+    """
+    Bulk import of patients from the request body: CSV with a header line
+    (Content-Type: text/csv), a JSON array or JSON lines, with the fields of
+    patient registration. Imported patients get new medical record numbers and
+    are not added to the queue. A file with invalid rows imports nothing.
+    """
+    body = await request.body()
+    try:
+        # Parsing and the inserts run in the threadpool, like the sync endpoints
+        patients = await run_in_threadpool(parse_patient_rows, body, request.headers.get("content-type", ""))
+        return await run_in_threadpool(import_patients, session, validate_patient_rows(patients))
+    except PatientImportError as e:
+        raise HTTPException(status_code=e.status_code, detail={"message": str(e), "errors": e.errors, "error_count": e.error_count})
 
 @router.put("/{patient_id}", response_model=Patient)
 def update_patient(patient_id: int, patient_update: PatientUpdate, session: Session = Depends(get_session)):
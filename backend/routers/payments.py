@@ -2,13 +2,15 @@ from fastapi import APIRouter, HTTPException, Depends, Query
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 from datetime import datetime
-from sqlmodel import Session, select, func
+from sqlmodel import Session, select
 from database import get_session
 from models.payment import Payment, PaymentCreate, PaymentWithPatientInfo
 from models.patient import Patient
-from models.queue import QueueEntry
-from models.report import Examination, Prescription
-from models.drug import Drug
+from models.report import Examination
+from services.drug_catalogue import drug_catalogue
+from services.medical_records import fetch_prescriptions_by_examination, get_visit_queue_entry
+from services.queue_workflow import transition_entry, publish_transitions
+from utils.helpers import date_range_filter
 
 router = APIRouter(prefix="/payments", tags=["Payments"])
 
@@ -26,30 +28,41 @@ class PaymentWithDetails(BaseModel):
     patient_name: str
     details: List[Dict[str, Any]]
 
+def _parse_date(value: Optional[str]):
+    return datetime.strptime(value, "%Y-%m-%d").date() if value else None
+
 @router.get("/", response_model=List[PaymentWithDetails])
-def get_payments(session: Session = Depends(get_session), date: Optional[str] = None):
+def get_payments(
+    session: Session = Depends(get_session),
+    date: Optional[str] = None,
+    date_from: Optional[str] = Query(None, description="Inclusive, YYYY-MM-DD"),
+    date_to: Optional[str] = Query(None, description="Inclusive, YYYY-MM-DD"),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0)
+):
+    try:
+        # A single `date` is shorthand for date_from == date_to == date
+        first_day = _parse_date(date or date_from)
+        last_day = _parse_date(date or date_to)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
+
     try:
         query = select(Payment, Patient).join(Patient, Payment.patient_id == Patient.id)
 
-        if date:
-            try:
-                query = query.where(func.date(Payment.payment_date) == date)
-            except ValueError:
-                raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
+        # Half-open range on the indexed payment_date column
+        query = query.where(*date_range_filter(Payment.payment_date, first_day, last_day))
 
+        query = query.order_by(Payment.payment_date, Payment.id).offset(offset)
+        if limit:
+            query = query.limit(limit)
         payments_with_patients = session.exec(query).all()
 
-        # Get all prescriptions to build details
-        prescriptions = session.exec(select(Prescription)).all()
-        drugs = session.exec(select(Drug)).all()
-
-        # Create lookup maps for efficiency
-        drug_map = {d.id: d for d in drugs}
-        prescriptions_by_exam = {}
-        for pres in prescriptions:
-            if pres.examination_id not in prescriptions_by_exam:
-                prescriptions_by_exam[pres.examination_id] = []
-            prescriptions_by_exam[pres.examination_id].append(pres)
+        # Only load prescriptions for the examinations on this page
+        prescriptions_by_exam = fetch_prescriptions_by_examination(
+            session, (payment.examination_id for payment, _ in payments_with_patients)
+        )
+        drug_map = drug_catalogue.by_id(session)
 
         enriched_payments = []
         for payment, patient in payments_with_patients:
@@ -58,17 +71,16 @@ def get_payments(session: Session = Depends(get_session), date: Optional[str] =
 
             # Add details for this payment's examination
             details = []
-            if payment.examination_id in prescriptions_by_exam:
-                for pres in prescriptions_by_exam[payment.examination_id]:
-                    drug = drug_map.get(pres.drug_id)
-                    if drug:
-                        cost = pres.quantity * drug.harga
-                        details.append({
-                            "drug_name": drug.nama,
-                            "quantity": pres.quantity,
-                            "price_per_unit": drug.harga,
-                            "total_cost": cost
-                        })
+            for pres in prescriptions_by_exam.get(payment.examination_id, []):
+                drug = drug_map.get(pres.drug_id)
+                if drug:
+                    cost = pres.quantity * drug.harga
+                    details.append({
+                        "drug_name": drug.nama,
+                        "quantity": pres.quantity,
+                        "price_per_unit": drug.harga,
+                        "total_cost": cost
+                    })
 
             payment_data["details"] = details
             enriched_payment = PaymentWithDetails(**payment_data)
@@ -105,27 +117,23 @@ def record_payment(payment_create: PaymentCreate, session: Session = Depends(get
     )
     session.add(new_payment)
     
-    # Update queue status to 'selesai' after payment (transition from 'membayar')
-    queue_entry = session.exec(
-        select(QueueEntry).where(QueueEntry.patient_id == payment_create.patient_id)
-        .order_by(QueueEntry.id.desc())
-    ).first()
+    # The visit the examination belongs to, loaded by primary key, is finished
+    # by the payment whatever its status; the workflow also updates the patient
+    queue_entry = get_visit_queue_entry(session, examination)
+    transition = None
 
     if queue_entry:
-        # Update queue status to 'selesai' from any status when payment is made
-        queue_entry.status = "selesai"
-        session.add(queue_entry)
-
-    # Update patient status to 'selesai' when payment is made
-    patient = session.exec(
-        select(Patient).where(Patient.id == payment_create.patient_id)
-    ).first()
-
-    if patient:
-        # Update patient status to 'selesai' from any status when payment is made
-        patient.status = "selesai"
-        session.add(patient)
+        new_payment.queue_entry_id = queue_entry.id
+        transition = transition_entry(session, queue_entry, "selesai", strict=False)
+    else:
+        patient = session.exec(
+            select(Patient).where(Patient.id == payment_create.patient_id)
+        ).first()
+        if patient:
+            patient.status = "selesai"
+            session.add(patient)
     
     session.commit()
     session.refresh(new_payment)
+    publish_transitions([transition])
     return new_payment
\ No newline at end of file
@@ -1,10 +1,13 @@
 from fastapi import APIRouter, HTTPException, Depends, Query
 from typing import List, Optional
-from sqlmodel import Session, select
+from sqlmodel import Session, select, func
 from database import get_session
 from models.report import Prescription, PrescriptionCreate, Examination # Prescription is in report.py
 from models.patient import Patient
 from models.drug import Drug # Need Drug for stock management
+from services.medical_records import get_visit_queue_entry
+from services import stock_ledger
+from services.queue_workflow import QueueTransition, transition_entry, publish_transitions
 
 router = APIRouter(prefix="/prescriptions", tags=["Prescriptions"])
 
@@ -33,10 +36,24 @@ def get_prescriptions(session: Session = Depends(get_session), status: Optional[
     prescriptions = session.exec(query).all()
     return prescriptions
 
+def _advance_to_payment(session: Session, examination: Examination) -> Optional[QueueTransition]:
+    """
+    Moves the examination's visit (by primary key) on to payment once all its
+    medicine is handed out; a visit that is already past the pharmacy keeps its status.
+    """
+    queue_entry = get_visit_queue_entry(session, examination)
+    if queue_entry:
+        return transition_entry(session, queue_entry, "membayar", strict=False)
+
+    patient = session.get(Patient, examination.patient_id)
+    if patient:
+        patient.status = "membayar"
+        session.add(patient)
+    return None
+
 @router.patch("/{prescription_id}/fulfill", response_model=Prescription)
 def fulfill_prescription(prescription_id: int, session: Session = Depends(get_session)):
     from models.patient import Patient
-    from models.queue import QueueEntry
     from models.report import Examination
 
     prescription_to_fulfill = session.exec(select(Prescription).where(Prescription.id == prescription_id)).first()
@@ -46,30 +63,22 @@ def fulfill_prescription(prescription_id: int, session: Session = Depends(get_se
     if prescription_to_fulfill.status == "selesai":
         raise HTTPException(status_code=400, detail="Prescription already fulfilled")
 
-    # Find the drug and decrease stock
-    drug_to_update = session.exec(select(Drug).where(Drug.id == prescription_to_fulfill.drug_id)).first()
-    if not drug_to_update:
-        raise HTTPException(status_code=404, detail="Drug in prescription not found in stock")
+    # Claim the prescription and decrease stock with conditional UPDATEs
+    try:
+        stock_ledger.fulfill_prescriptions(session, [prescription_to_fulfill])
+    except stock_ledger.StockLedgerError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
 
-    # Check if there is enough stock
-    if drug_to_update.stok < prescription_to_fulfill.quantity:
-        raise HTTPException(status_code=400, detail=f"Not enough stock for {drug_to_update.nama}. Required: {prescription_to_fulfill.quantity}, available: {drug_to_update.stok}")
-
-    drug_to_update.stok -= prescription_to_fulfill.quantity
-    session.add(drug_to_update)
-
-    # Update prescription status
-    prescription_to_fulfill.status = "selesai"
-    session.add(prescription_to_fulfill)
+    transition = None
 
     # Check if all prescriptions for the examination are now fulfilled
     examination_id = prescription_to_fulfill.examination_id
-    all_prescriptions = session.exec(
-        select(Prescription).where(Prescription.examination_id == examination_id)
-    ).all()
-
-    # Check if all prescriptions for this examination are now 'selesai'
-    all_fulfilled = all(p.status == "selesai" for p in all_prescriptions)
+    remaining = session.exec(
+        select(func.count()).select_from(Prescription)
+        .where(Prescription.examination_id == examination_id)
+        .where(Prescription.status != "selesai")
+    ).one()
+    all_fulfilled = remaining == 0
 
     if all_fulfilled:
         # Find the examination to get the patient_id
@@ -78,30 +87,12 @@ def fulfill_prescription(prescription_id: int, session: Session = Depends(get_se
         ).first()
 
         if examination:
-            # Update patient and queue status to 'membayar' after getting medicine from pharmacy
-            patient = session.exec(select(Patient).where(Patient.id == examination.patient_id)).first()
-            if patient:
-                patient.status = "membayar"
-                session.add(patient)
-
-            # Find the queue entry based on patient
-            queue_entry = session.exec(
-                select(QueueEntry).where(QueueEntry.patient_id == examination.patient_id)
-                .order_by(QueueEntry.id.desc())
-            ).first()
-
-            if queue_entry:
-                queue_entry.status = "membayar"
-                session.add(queue_entry)
+            # The visit goes on to payment after getting medicine from pharmacy
+            transition = _advance_to_payment(session, examination)
 
     session.commit()
     session.refresh(prescription_to_fulfill)
-    if drug_to_update:
-        session.refresh(drug_to_update)
-    if patient:
-        session.refresh(patient)
-    if queue_entry:
-        session.refresh(queue_entry)
+    publish_transitions([transition])
 
     return prescription_to_fulfill
 
@@ -134,7 +125,6 @@ def fulfill_all_prescriptions(examination_id: int, session: Session = Depends(ge
     """Fulfill all prescriptions for a single examination at once"""
     from models.report import Examination
     from models.patient import Patient
-    from models.queue import QueueEntry
 
     # Get all prescriptions for this examination
     prescriptions = session.exec(
@@ -142,34 +132,20 @@ def fulfill_all_prescriptions(examination_id: int, session: Session = Depends(ge
     ).all()
 
     if not prescriptions:
-        from fastapi import HTTPException
         raise HTTPException(status_code=404, detail="No prescriptions found for this examination")
 
     # Check if all prescriptions are not already fulfilled
     if all(p.status == "selesai" for p in prescriptions):
         raise HTTPException(status_code=400, detail="All prescriptions for this examination have already been fulfilled")
 
-    # Process each prescription
-    updated_prescriptions = []
-    for prescription in prescriptions:
-        if prescription.status != "selesai":
-            # Find the drug and decrease stock
-            drug_to_update = session.exec(select(Drug).where(Drug.id == prescription.drug_id)).first()
-            if not drug_to_update:
-                raise HTTPException(status_code=404, detail=f"Drug in prescription not found in stock: {prescription.drug_id}")
-
-            # Check if there is enough stock
-            if drug_to_update.stok < prescription.quantity:
-                raise HTTPException(status_code=400, detail=f"Not enough stock for {drug_to_update.nama}. Required: {prescription.quantity}, available: {drug_to_update.stok}")
+    # Claim all open prescriptions and decrease their stock in one batch
+    updated_prescriptions = [p for p in prescriptions if p.status != "selesai"]
+    try:
+        stock_ledger.fulfill_prescriptions(session, updated_prescriptions)
+    except stock_ledger.StockLedgerError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
 
-            drug_to_update.stok -= prescription.quantity
-            session.add(drug_to_update)
-
-            # Update prescription status
-            prescription.status = "selesai"
-            session.add(prescription)
-
-            updated_prescriptions.append(prescription)
+    transition = None
 
     # Update patient and queue status to 'membayar' since all medicines are given
     examination = session.exec(
@@ -177,21 +153,7 @@ def fulfill_all_prescriptions(examination_id: int, session: Session = Depends(ge
     ).first()
 
     if examination:
-        # Update patient and queue status to 'membayar' after getting medicine from pharmacy
-        patient = session.exec(select(Patient).where(Patient.id == examination.patient_id)).first()
-        if patient:
-            patient.status = "membayar"
-            session.add(patient)
-
-        # Find the queue entry based on patient
-        queue_entry = session.exec(
-            select(QueueEntry).where(QueueEntry.patient_id == examination.patient_id)
-            .order_by(QueueEntry.id.desc())
-        ).first()
-
-        if queue_entry:
-            queue_entry.status = "membayar"
-            session.add(queue_entry)
+        transition = _advance_to_payment(session, examination)
 
     session.commit()
 
@@ -199,10 +161,7 @@ def fulfill_all_prescriptions(examination_id: int, session: Session = Depends(ge
     for pres in updated_prescriptions:
         session.refresh(pres)
 
-    if patient:
-        session.refresh(patient)
-    if queue_entry:
-        session.refresh(queue_entry)
+    publish_transitions([transition])
 
     return updated_prescriptions
 
@@ -210,7 +169,12 @@ def fulfill_all_prescriptions(examination_id: int, session: Session = Depends(ge
 # Import BaseModel for response model
 from pydantic import BaseModel
 from typing import Optional
-from datetime import datetime
+from datetime import datetime, date
+from fastapi.responses import StreamingResponse
+from database import engine
+from utils.helpers import date_range_filter
+
+REPORT_STREAM_BATCH_SIZE = 500
 
 class PrescriptionWithPatientInfo(BaseModel):
     id: int
@@ -224,80 +188,59 @@ class PrescriptionWithPatientInfo(BaseModel):
     drug_name: str
     drug_price: int
     prescription_date: datetime
+
+def _prescription_report_query(status: Optional[str], date_from: Optional[date], date_to: Optional[date]):
+    """Prescription joined with its examination, patient and drug; outer joins keep rows with missing data."""
+    query = (
+        select(Prescription, Examination.date, Patient.name, Patient.medicalRecordNo, Drug.nama, Drug.harga)
+        .outerjoin(Examination, Examination.id == Prescription.examination_id)
+        .outerjoin(Patient, Patient.id == Examination.patient_id)
+        .outerjoin(Drug, Drug.id == Prescription.drug_id)
+    )
+    if status:
+        query = query.where(Prescription.status == status)
+    query = query.where(*date_range_filter(Examination.date, date_from, date_to))
+    return query.order_by(Prescription.id)
+
+def _to_report_row(row) -> PrescriptionWithPatientInfo:
+    pres, exam_date, patient_name, medical_record_no, drug_name, drug_price = row
+    return PrescriptionWithPatientInfo(
+        id=pres.id,
+        examination_id=pres.examination_id or 0,  # Use 0 as default if None
+        drug_id=pres.drug_id or 0,  # Use 0 as default if None
+        quantity=pres.quantity,
+        notes=pres.notes,
+        status=pres.status,
+        patient_name=patient_name if patient_name is not None else "Data tidak ditemukan",
+        patient_medical_record_no=medical_record_no or "N/A",
+        drug_name=drug_name if drug_name is not None else "Data tidak ditemukan",
+        drug_price=drug_price or 0,
+        prescription_date=exam_date or datetime.now()
+    )
+
 @router.get("/report", response_model=List[PrescriptionWithPatientInfo])
 def get_prescription_report(
     session: Session = Depends(get_session),
-    status: Optional[str] = Query(None, description="Filter by prescription status (menunggu/selesai)")
+    status: Optional[str] = Query(None, description="Filter by prescription status (menunggu/selesai)"),
+    date_from: Optional[date] = Query(None, description="Inclusive examination date, YYYY-MM-DD"),
+    date_to: Optional[date] = Query(None, description="Inclusive examination date, YYYY-MM-DD"),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    stream: bool = Query(False, description="Stream all matching rows as NDJSON instead of a JSON list")
 ):
     """Get prescription report with patient and drug information"""
-    # Build query based on status filter
-    query = select(
-        Prescription
-    )
+    query = _prescription_report_query(status, date_from, date_to)
 
-    if status:
-        query = query.where(Prescription.status == status)
+    if stream:
+        def generate():
+            # The request session may be closed before streaming finishes, so use a dedicated one
+            with Session(engine) as stream_session:
+                for row in stream_session.exec(query.execution_options(yield_per=REPORT_STREAM_BATCH_SIZE)):
+                    yield _to_report_row(row).model_dump_json() + "\n"
 
-    prescriptions = session.exec(query).all()
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
 
-    result = []
-    for pres in prescriptions:
-        # Get related information for each prescription
-        patient_name = "Data tidak ditemukan"
-        patient_medical_record_no = "N/A"
-        drug_name = "Data tidak ditemukan"
-        drug_price = 0
-        prescription_date = getattr(pres, 'created_at', datetime.now())
-
-        # Get related data using manual queries to avoid join issues
-        try:
-            # Get patient info via examination
-            if pres.examination_id:
-                examination = session.exec(
-                    select(Examination).where(Examination.id == pres.examination_id)
-                ).first()
-
-                if examination:
-                    patient = session.exec(
-                        select(Patient).where(Patient.id == examination.patient_id)
-                    ).first()
-
-                    if patient:
-                        patient_name = patient.name
-                        patient_medical_record_no = patient.medicalRecordNo or "N/A"
-
-                    if examination.date:
-                        prescription_date = examination.date
-
-            # Get drug info
-            if pres.drug_id:
-                drug = session.exec(
-                    select(Drug).where(Drug.id == pres.drug_id)
-                ).first()
-
-                if drug:
-                    drug_name = drug.nama
-                    drug_price = drug.harga or 0
-
-        except Exception as e:
-            # Log error but continue processing
-            print(f"Error getting related data for prescription {pres.id}: {str(e)}")
-            pass
-
-        prescription_data = {
-            "id": pres.id,
-            "examination_id": pres.examination_id or 0,  # Use 0 as default if None
-            "drug_id": pres.drug_id or 0,  # Use 0 as default if None
-            "quantity": pres.quantity,
-            "notes": pres.notes,
-            "status": pres.status,
-            "patient_name": patient_name,
-            "patient_medical_record_no": patient_medical_record_no,
-            "drug_name": drug_name,
-            "drug_price": drug_price,
-            "prescription_date": prescription_date
-        }
-
-        result.append(PrescriptionWithPatientInfo(**prescription_data))
-
-    return result
+    query = query.offset(offset)
+    if limit:
+        query = query.limit(limit)
+    return [_to_report_row(row) for row in session.exec(query).all()]
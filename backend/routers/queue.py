@@ -1,20 +1,36 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+import asyncio
+from datetime import date
+from fastapi import APIRouter, HTTPException, status, Depends, Header, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
 from sqlmodel import Session, select
-from database import get_session
-from models.queue import QueueEntry, QueueUpdateStatus
+from database import engine, get_session
+from utils.helpers import date_range_bounds
+from models.queue import QueueEntry, QueueUpdateStatus, QueueTransitionRequest
 from models.patient import Patient
 from models.report import Examination
 from models.payment import Payment
+from services.queue_events import queue_event, queue_event_bus
+from services.table_versions import conditional_get, get_table_versions, local_table_versions
+from services.queue_stats import ACTIVE_QUEUE_STATUSES, active_queue_filter
+from services.queue_analytics import QueueAnalytics, get_queue_analytics
+from services.queue_workflow import QueueWorkflowError, transition_queue_entry, transition_matching, publish_transitions
+
+QUEUE_EVENTS_KEEPALIVE_SECONDS = 15
+QUEUE_TABLE = QueueEntry.__tablename__
 
 router = APIRouter(prefix="/queue", tags=["Queue"])
 
-@router.get("/", response_model=List[QueueEntry])
-def get_queue(status: Optional[str] = None, doctor_id: Optional[int] = None, session: Session = Depends(get_session)):
+@router.get("/", response_model=List[QueueEntry], dependencies=[Depends(conditional_get(QueueEntry, Patient))])
+def get_queue(status: Optional[str] = None, doctor_id: Optional[int] = None, active: bool = False, session: Session = Depends(get_session)):
+    """`active=true` returns only unfinished entries, read from the partial active-queue indexes"""
     query = select(QueueEntry, Patient).join(Patient, QueueEntry.patient_id == Patient.id)
     
     if status:
         query = query.where(QueueEntry.status == status)
+    if active or status in ACTIVE_QUEUE_STATUSES:
+        query = query.where(active_queue_filter())
         
     if doctor_id:
         query = query.where(QueueEntry.doctor_id == doctor_id)
@@ -30,6 +46,86 @@ def get_queue(status: Optional[str] = None, doctor_id: Optional[int] = None, ses
     
     return result
 
+@router.get("/events")
+async def stream_queue_events(
+    request: Request,
+    status: Optional[str] = None,
+    doctor_id: Optional[int] = None,
+    last_event_id: Optional[int] = Header(None)
+):
+    """
+    Server-Sent Events stream of queue changes (created, status_changed, deleted),
+    filtered like GET /queue/. Load GET /queue/ once, then apply the events.
+    An event named "resync" means events were lost and the list must be reloaded.
+
+    Events come from the process that made the change. With several workers,
+    the queue's table version is compared with the versions this process
+    committed, on connect, with every event and on every keepalive; a change
+    made by another worker ends the stream with "resync" as well.
+    """
+    subscription = queue_event_bus.subscribe(status, doctor_id, last_event_id)
+    current_version = await run_in_threadpool(_queue_table_version)
+    # A replayed stream continues from the version of its Last-Event-ID event
+    seen_version = subscription.table_version if subscription.table_version is not None else current_version
+    missed_remote_changes = not local_table_versions.covers(QUEUE_TABLE, seen_version, current_version)
+
+    async def generate():
+        nonlocal seen_version
+        try:
+            yield "retry: 3000\n\n"
+            if missed_remote_changes:
+                yield "event: resync\ndata: {}\n\n"
+                return
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(subscription.get(), QUEUE_EVENTS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    version = await run_in_threadpool(_queue_table_version)
+                    if not local_table_versions.covers(QUEUE_TABLE, seen_version, version):
+                        yield "event: resync\ndata: {}\n\n"
+                        break
+                    seen_version = max(seen_version, version)
+                    yield ": keepalive\n\n"
+                    continue
+                if event is not None and not local_table_versions.covers(QUEUE_TABLE, seen_version, event.table_version):
+                    event = None
+                if event is None:
+                    yield "event: resync\ndata: {}\n\n"
+                    break
+                seen_version = max(seen_version, event.table_version)
+                yield f"id: {event.id}\nevent: {event.type}\ndata: {event.model_dump_json()}\n\n"
+        finally:
+            queue_event_bus.unsubscribe(subscription)
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def _queue_table_version() -> int:
+    with Session(engine) as session:
+        return get_table_versions(session, [QUEUE_TABLE]).get(QUEUE_TABLE, 0)
+
+@router.get("/events/stats")
+def get_queue_event_stats():
+    """Subscriber and publish counters of the in-process queue event bus"""
+    return queue_event_bus.stats()
+
+@router.get("/analytics", response_model=QueueAnalytics)
+def get_queue_wait_analytics(
+    date_from: Optional[date] = Query(None, description="Default: today"),
+    date_to: Optional[date] = Query(None, description="Inclusive; default: date_from"),
+    doctor_id: Optional[int] = None,
+    session: Session = Depends(get_session)
+):
+    """Wait-time percentiles per stage, hourly throughput and per-doctor throughput from the status transition log"""
+    date_from = date_from or date.today()
+    start, end = date_range_bounds(date_from, date_to or date_from)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="date_to must not be before date_from")
+    return get_queue_analytics(session, start, end, doctor_id)
+
 @router.get("/{queue_id}/details")
 def get_queue_details(queue_id: int, session: Session = Depends(get_session)):
     queue_entry = session.exec(select(QueueEntry).where(QueueEntry.id == queue_id)).first()
@@ -49,30 +145,48 @@ def get_queue_details(queue_id: int, session: Session = Depends(get_session)):
     }
 
 @router.put("/{queue_id}", response_model=QueueEntry)
-def update_queue_status(queue_id: int, status_update: QueueUpdateStatus, session: Session = Depends(get_session)):
-    queue_entry = session.exec(select(QueueEntry).where(QueueEntry.id == queue_id)).first()
-    if not queue_entry:
-        raise HTTPException(status_code=404, detail="Queue entry not found")
+def update_queue_status(queue_id: int, status_update: QueueUpdateStatus, force: bool = False, session: Session = Depends(get_session)):
+    """
+    Moves the entry along the queue workflow (services.queue_workflow.QUEUE_TRANSITIONS);
+    a change the workflow does not allow answers 409 unless `force=true`.
+    """
+    try:
+        queue_entry, transition = transition_queue_entry(session, queue_id, status_update.status, force)
+    except QueueWorkflowError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
 
-    patient = session.exec(select(Patient).where(Patient.id == queue_entry.patient_id)).first()
-    if not patient:
-        raise HTTPException(status_code=404, detail="Patient for this queue not found")
+    session.commit()
+    session.refresh(queue_entry)
+    publish_transitions([transition])
 
-    # Optional: Validate status transitions to ensure proper flow
-    valid_statuses = {"menunggu", "diperiksa", "apotek", "membayar", "selesai"}
-    if status_update.status not in valid_statuses:
-        raise HTTPException(status_code=400, detail=f"Invalid status. Valid statuses: {', '.join(sorted(valid_statuses))}")
+    return queue_entry
 
-    queue_entry.status = status_update.status
-    patient.status = status_update.status
+@router.post("/transitions")
+def transition_queue_entries(payload: QueueTransitionRequest, session: Session = Depends(get_session)):
+    """
+    Batch status change, e.g. closing yesterday's unfinished visits with
+    {"status": "selesai", "created_before": "2024-05-02"}. Entries the workflow
+    does not allow to change are skipped and listed with the reason.
+    """
+    try:
+        batch = transition_matching(
+            session,
+            payload.status,
+            queue_ids=payload.queue_ids,
+            from_statuses=payload.from_statuses,
+            doctor_id=payload.doctor_id,
+            created_before=payload.created_before,
+        )
+    except QueueWorkflowError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
 
-    session.add(queue_entry)
-    session.add(patient)
     session.commit()
-    session.refresh(queue_entry)
-    session.refresh(patient)
+    publish_transitions(batch.transitions)
 
-    return queue_entry
+    return {
+        "transitioned": [transition.queue_id for transition in batch.transitions],
+        "skipped": batch.skipped,
+    }
 
 @router.delete("/{queue_id}", status_code=status.HTTP_200_OK)
 def cancel_queue_entry(queue_id: int, session: Session = Depends(get_session)):
@@ -82,6 +196,7 @@ def cancel_queue_entry(queue_id: int, session: Session = Depends(get_session)):
 
     # Get patient ID before deleting queue entry
     patient_id = queue_entry.patient_id
+    deleted_event = queue_event("deleted", queue_entry, queue_entry.status)
 
     # Delete the queue entry
     session.delete(queue_entry)
@@ -109,5 +224,6 @@ def cancel_queue_entry(queue_id: int, session: Session = Depends(get_session)):
             session.delete(patient)
 
     session.commit()
+    queue_event_bus.publish(deleted_event)
 
     return {"message": f"Queue entry {queue_id} deleted successfully, patient was {'deleted' if not examinations and not payments and not other_queue_entries else 'kept'}"}
\ No newline at end of file
@@ -1,11 +1,11 @@
-from fastapi import APIRouter, Body, HTTPException, Depends
-from typing import List
-from datetime import datetime
-from sqlmodel import Session, select, func # Import func for aggregation
+from fastapi import APIRouter, Body, HTTPException, Depends, Query
+from typing import List, Optional
+from datetime import datetime, date
+import calendar
+from sqlmodel import Session, select
 from database import get_session
-from models.report import Report, ReportSummary, Examination, Prescription # Report, Examination, Prescription are now SQLModels
-from models.payment import Payment # Payment is now SQLModel
-from models.drug import Drug # Drug is now SQLModel
+from models.report import Report, ReportSummary
+from services.report_rollups import build_report_summary
 
 router = APIRouter(prefix="/reports", tags=["Reports"])
 
@@ -17,18 +17,13 @@ def generate_and_store_report(payload: dict = Body(...), session: Session = Depe
     if not report_type or not period:
         raise HTTPException(status_code=400, detail="Report type and period are required")
 
-    # Base query for payments
-    payments_query = select(Payment)
-    
-    # Filter payments based on period
+    # Resolve the period into an inclusive day range
     try:
         if report_type == "DAILY":
-            filter_date = datetime.strptime(period, "%Y-%m-%d").date()
-            payments_query = payments_query.where(func.date(Payment.payment_date) == filter_date.isoformat())
+            first_day = last_day = datetime.strptime(period, "%Y-%m-%d").date()
         elif report_type == "MONTHLY":
-            # For monthly, compare YYYY-MM
-            filter_month = datetime.strptime(period, "%Y-%m").strftime("%Y-%m")
-            payments_query = payments_query.where(func.strftime('%Y-%m', Payment.payment_date) == filter_month)
+            first_day = datetime.strptime(period, "%Y-%m").date()
+            last_day = date(first_day.year, first_day.month, calendar.monthrange(first_day.year, first_day.month)[1])
         else:
             raise HTTPException(status_code=400, detail="Invalid report type. Use DAILY or MONTHLY.")
     except ValueError:
@@ -45,59 +40,78 @@ def generate_and_store_report(payload: dict = Body(...), session: Session = Depe
             notes=manual_summary.get("notes", ""),
             drugs_used=manual_summary.get("drugs_used", {})
         )
-    else:
-        filtered_payments = session.exec(payments_query).all()
-
-        # --- Calculation Logic using SQLModel ---
-
-        # 1. Total income from filtered payments
-        total_income = sum(p.total_amount for p in filtered_payments)
-
-        paid_examination_ids = {p.examination_id for p in filtered_payments}
+        new_report = Report(
+            generated_at=datetime.now(),
+            type=report_type,
+            period=period,
+            summary=report_summary.json() # Serialize ReportSummary to JSON string
+        )
+        session.add(new_report)
+        session.commit()
+        session.refresh(new_report)
+        return new_report
 
-        # 2. Total unique patients from paid examinations in the period
-        # Need to query examinations that were paid for in this period
-        total_patients = 0
-        drugs_used = {}
-        
-        if paid_examination_ids:
-            paid_patients_count = session.exec(
-                select(func.count(func.distinct(Examination.patient_id)))
-                .where(Examination.id.in_(list(paid_examination_ids)))
-            ).first()
-            total_patients = paid_patients_count if paid_patients_count else 0
+    # A closed period cannot change anymore, so an existing final report is reused
+    closed = last_day < date.today()
+    force = bool(payload.get("force"))
+    existing_report = _get_latest_report(session, report_type, period)
+    if existing_report and closed and not existing_report.provisional and not force:
+        return existing_report
 
-            # 3. Drugs used from prescriptions linked to paid examinations in the period
-            prescriptions_in_period = session.exec(
-                select(Prescription, Drug)
-                .join(Drug)
-                .where(Prescription.examination_id.in_(list(paid_examination_ids)))
-            ).all()
-            
-            for pres, drug in prescriptions_in_period:
-                drugs_used[drug.nama] = drugs_used.get(drug.nama, 0) + pres.quantity
+    # Aggregated in SQL per day; closed days come from the daily rollup table,
+    # which `force` recomputes so corrections made since are picked up
+    report_summary = build_report_summary(session, first_day, last_day, refresh=force)
 
-        report_summary = ReportSummary(
-            total_patients=total_patients,
-            total_income=total_income,
-            drugs_used=drugs_used
-        )
+    # A provisional or forced report is refreshed in place instead of piling up new rows
+    if existing_report and (existing_report.provisional or force):
+        report = existing_report
+    else:
+        report = Report(type=report_type, period=period, summary="")
+    report.generated_at = datetime.now()
+    report.summary = report_summary.json() # Serialize ReportSummary to JSON string
+    report.provisional = not closed
 
-    # Storing logic
-    new_report = Report(
-        generated_at=datetime.now(),
-        type=report_type,
-        period=period,
-        summary=report_summary.json() # Serialize ReportSummary to JSON string
-    )
-    
-    session.add(new_report)
+    session.add(report)
     session.commit()
-    session.refresh(new_report)
+    session.refresh(report)
     
-    return new_report
+    return report
+
+def _get_latest_report(session: Session, report_type: str, period: str) -> Optional[Report]:
+    return session.exec(
+        select(Report)
+        .where(Report.type == report_type)
+        .where(Report.period == period)
+        .order_by(Report.generated_at.desc())
+    ).first()
+
+@router.get("/summary", response_model=ReportSummary)
+def get_report_summary(type: str = Query(...), period: str = Query(...), session: Session = Depends(get_session)):
+    """Summary of the latest stored report for (type, period), without fetching the report list"""
+    report = _get_latest_report(session, type, period)
+    if not report:
+        raise HTTPException(status_code=404, detail="Report not found")
+    return report.get_summary_obj()
 
 @router.get("/", response_model=List[Report])
-def get_all_reports(session: Session = Depends(get_session)):
-    reports = session.exec(select(Report).order_by(Report.generated_at.desc())).all()
+def get_all_reports(
+    session: Session = Depends(get_session),
+    type: Optional[str] = Query(None, description="DAILY or MONTHLY"),
+    period: Optional[str] = Query(None, description="Exact period, or a prefix such as YYYY-MM for daily reports"),
+    provisional: Optional[bool] = None,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    offset: int = Query(0, ge=0)
+):
+    query = select(Report)
+    if type:
+        query = query.where(Report.type == type)
+    if period:
+        query = query.where(Report.period.startswith(period))
+    if provisional is not None:
+        query = query.where(Report.provisional == provisional)
+
+    query = query.order_by(Report.generated_at.desc()).offset(offset)
+    if limit:
+        query = query.limit(limit)
+    reports = session.exec(query).all()
     return reports
\ No newline at end of file
@@ -3,10 +3,11 @@ from typing import List, Dict
 from sqlmodel import Session, select
 from database import get_session
 from models.schedule import ScheduleEntry, ScheduleCreate # ScheduleEntry is now SQLModel
+from services.table_versions import conditional_get
 
 router = APIRouter(prefix="/schedules", tags=["Schedules"])
 
-@router.get("/", response_model=List[ScheduleEntry])
+@router.get("/", response_model=List[ScheduleEntry], dependencies=[Depends(conditional_get(ScheduleEntry))])
 def get_schedules(session: Session = Depends(get_session)):
     schedules = session.exec(select(ScheduleEntry)).all()
     return schedules
@@ -0,0 +1,57 @@
+import threading
+from typing import Dict, Optional
+
+from sqlmodel import Session, select
+from models.drug import Drug
+from services.table_versions import get_table_versions
+
+DRUG_TABLE = Drug.__tablename__
+
+class DrugCatalogue:
+    """
+    In-process cache of the Drug table (id -> Drug).
+    Entries are detached copies and must be treated as read-only; load the row
+    through the session when it needs to be modified.
+
+    Each lookup compares the cached copy with the Drug table version, one
+    primary key read, so writes made through any worker are seen at once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_id: Dict[int, Drug] = {}
+        self._version: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+
+    def _ensure_loaded(self, session: Session) -> Dict[int, Drug]:
+        # Read before the rows, so a write racing the load leaves an older version behind
+        version = get_table_versions(session, [DRUG_TABLE]).get(DRUG_TABLE)
+        with self._lock:
+            if version is not None and version == self._version:
+                self.hits += 1
+                return self._by_id
+            self.misses += 1
+
+        by_id = {d.id: Drug(**d.model_dump()) for d in session.exec(select(Drug).order_by(Drug.id)).all()}
+
+        with self._lock:
+            self._by_id = by_id
+            self._version = version
+        return by_id
+
+    def by_id(self, session: Session) -> Dict[int, Drug]:
+        return self._ensure_loaded(session)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "size": len(self._by_id),
+                "version": self._version,
+            }
+
+drug_catalogue = DrugCatalogue()
@@ -0,0 +1,211 @@
+import base64
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlmodel import Session, select, func, or_, and_
+from models.report import Examination, Prescription, MedicalRecordResponse, MedicalRecordListResponse, PatientInfo, DoctorInfo
+from models.patient import Patient
+from models.employee import Employee
+from models.queue import QueueEntry
+from utils.helpers import date_range_filter
+
+# Keep IN (...) lists well below SQLite's bound-parameter limit
+IN_CLAUSE_CHUNK_SIZE = 500
+
+def _chunked(ids: Iterable[int], size: int = IN_CLAUSE_CHUNK_SIZE):
+    unique_ids = sorted({i for i in ids if i is not None})
+    for start in range(0, len(unique_ids), size):
+        yield unique_ids[start:start + size]
+
+def fetch_patients_by_id(session: Session, patient_ids: Iterable[int]) -> Dict[int, Patient]:
+    patients = {}
+    for chunk in _chunked(patient_ids):
+        for patient in session.exec(select(Patient).where(Patient.id.in_(chunk))).all():
+            patients[patient.id] = patient
+    return patients
+
+def fetch_doctors_by_id(session: Session, doctor_ids: Iterable[int]) -> Dict[int, Employee]:
+    doctors = {}
+    for chunk in _chunked(doctor_ids):
+        for doctor in session.exec(select(Employee).where(Employee.id.in_(chunk))).all():
+            doctors[doctor.id] = doctor
+    return doctors
+
+def fetch_prescriptions_by_examination(session: Session, examination_ids: Iterable[int]) -> Dict[int, List[Prescription]]:
+    prescriptions = defaultdict(list)
+    for chunk in _chunked(examination_ids):
+        rows = session.exec(
+            select(Prescription)
+            .where(Prescription.examination_id.in_(chunk))
+            .order_by(Prescription.id)
+        ).all()
+        for pres in rows:
+            prescriptions[pres.examination_id].append(pres)
+    return prescriptions
+
+def fetch_latest_queue_entries(session: Session, patient_ids: Iterable[int]) -> Dict[int, QueueEntry]:
+    """Latest QueueEntry (highest id) per patient, via a MAX(id) ... GROUP BY patient_id subquery."""
+    latest = {}
+    for chunk in _chunked(patient_ids):
+        latest_ids = (
+            select(func.max(QueueEntry.id))
+            .where(QueueEntry.patient_id.in_(chunk))
+            .group_by(QueueEntry.patient_id)
+        )
+        for entry in session.exec(select(QueueEntry).where(QueueEntry.id.in_(latest_ids))).all():
+            latest[entry.patient_id] = entry
+    return latest
+
+def fetch_visit_queue_entries(session: Session, examinations: Sequence[Examination]) -> Dict[int, QueueEntry]:
+    """
+    QueueEntry of each examination's visit, keyed by examination id, loaded by
+    primary key through Examination.queue_entry_id. Examinations without the link
+    (none left after the startup backfill, unless no visit matched) fall back to
+    the patient's latest entry.
+    """
+    entries = {}
+    linked_ids = list({e.queue_entry_id for e in examinations if e.queue_entry_id is not None})
+    for chunk in _chunked(linked_ids):
+        for entry in session.exec(select(QueueEntry).where(QueueEntry.id.in_(chunk))).all():
+            entries[entry.id] = entry
+
+    unlinked = [e for e in examinations if e.queue_entry_id is None]
+    latest = fetch_latest_queue_entries(session, {e.patient_id for e in unlinked}) if unlinked else {}
+
+    visits = {}
+    for exam in examinations:
+        entry = entries.get(exam.queue_entry_id) if exam.queue_entry_id is not None else latest.get(exam.patient_id)
+        if entry:
+            visits[exam.id] = entry
+    return visits
+
+def get_visit_queue_entry(session: Session, examination: Examination) -> Optional[QueueEntry]:
+    return fetch_visit_queue_entries(session, [examination]).get(examination.id)
+
+def assemble_medical_records(session: Session, examinations: Sequence[Examination]) -> List[MedicalRecordResponse]:
+    """
+    Build MedicalRecordResponse objects for the given examinations.
+    Patients, doctors and prescriptions are loaded with batched IN-list
+    queries instead of one SELECT per examination.
+    """
+    patient_map = fetch_patients_by_id(session, (e.patient_id for e in examinations))
+    doctor_map = fetch_doctors_by_id(session, (e.doctor_id for e in examinations))
+    prescriptions_by_exam = fetch_prescriptions_by_examination(session, (e.id for e in examinations))
+
+    records = []
+    for exam in examinations:
+        patient = patient_map.get(exam.patient_id)
+        doctor = doctor_map.get(exam.doctor_id)
+        records.append(MedicalRecordResponse(
+            id=exam.id,
+            patient_id=exam.patient_id,
+            complaint=exam.complaint,
+            diagnosis=exam.diagnosis,
+            notes=exam.notes,
+            date=exam.date,
+            patient=PatientInfo(
+                id=patient.id,
+                medicalRecordNo=patient.medicalRecordNo,
+                name=patient.name,
+                dob=patient.dob,
+                gender=patient.gender,
+                phone=patient.phone,
+                address=patient.address
+            ) if patient else None,
+            doctor=DoctorInfo(
+                id=doctor.id,
+                name=doctor.name
+            ) if doctor else None,
+            prescriptions=prescriptions_by_exam.get(exam.id, [])
+        ))
+    return records
+
+
+# --- Keyset pagination on (Examination.date, Examination.id) ---
+
+def encode_cursor(exam: Examination) -> str:
+    raw = f"{exam.date.isoformat()}|{exam.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Raises ValueError for malformed cursors."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        exam_date, exam_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(exam_date), int(exam_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def get_medical_record_page(
+    session: Session,
+    doctor_id: Optional[int] = None,
+    patient_id: Optional[int] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    diagnosis: Optional[str] = None,
+    limit: Optional[int] = None,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+) -> MedicalRecordListResponse:
+    """
+    Return one page of medical records, newest first; without `limit` all
+    matching records, as before paging existed. `before` continues with older records than the cursor, `after` goes back to newer ones.
+    `total` is a COUNT(*) over the filters only, so it does not depend on the page.
+    """
+    if before and after:
+        raise ValueError("Use either 'before' or 'after', not both")
+
+    filters = []
+    if doctor_id is not None:
+        filters.append(Examination.doctor_id == doctor_id)
+    if patient_id is not None:
+        filters.append(Examination.patient_id == patient_id)
+    filters.extend(date_range_filter(Examination.date, date_from, date_to))
+    if diagnosis:
+        filters.append(Examination.diagnosis.ilike(f"%{diagnosis}%"))
+
+    total = session.exec(select(func.count()).select_from(Examination).where(*filters)).one()
+
+    query = select(Examination).where(*filters)
+    if after:
+        cursor_date, cursor_id = decode_cursor(after)
+        query = query.where(or_(
+            Examination.date > cursor_date,
+            and_(Examination.date == cursor_date, Examination.id > cursor_id)
+        )).order_by(Examination.date.asc(), Examination.id.asc())
+    else:
+        if before:
+            cursor_date, cursor_id = decode_cursor(before)
+            query = query.where(or_(
+                Examination.date < cursor_date,
+                and_(Examination.date == cursor_date, Examination.id < cursor_id)
+            ))
+        query = query.order_by(Examination.date.desc(), Examination.id.desc())
+
+    # Fetch one extra row to know whether another page exists in this direction
+    if limit is not None:
+        query = query.limit(limit + 1)
+    examinations = list(session.exec(query).all())
+    has_more = limit is not None and len(examinations) > limit
+    examinations = examinations[:limit]
+
+    next_cursor = prev_cursor = None
+    if after:
+        examinations.reverse()
+        if examinations:
+            next_cursor = encode_cursor(examinations[-1])
+            if has_more:
+                prev_cursor = encode_cursor(examinations[0])
+    elif examinations:
+        if has_more:
+            next_cursor = encode_cursor(examinations[-1])
+        if before:
+            prev_cursor = encode_cursor(examinations[0])
+
+    return MedicalRecordListResponse(
+        records=assemble_medical_records(session, examinations),
+        total=total,
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor
+    )
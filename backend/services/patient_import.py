@@ -0,0 +1,109 @@
+import csv
+import io
+import json
+from typing import List, Tuple
+
+from pydantic import ValidationError
+from sqlmodel import Session, insert
+from models.patient import Patient, PatientCreate
+from services.record_numbers import next_medical_record_nos
+
+PATIENT_IMPORT_BATCH_SIZE = 1000 # Rows per executemany
+PATIENT_IMPORT_MAX_ERRORS = 50 # Errors reported back; the rest are only counted
+PATIENT_IMPORT_STATUS = "selesai" # Imported patients are not in the queue
+
+# Imported rows are all-or-nothing: every row is validated first, and a file
+# with errors imports nothing, so a migration can be fixed and re-run as a whole.
+
+class PatientImportError(Exception):
+    status_code = 400
+
+    def __init__(self, message: str, errors: List[dict], error_count: int):
+        super().__init__(message)
+        self.errors = errors
+        self.error_count = error_count
+
+def parse_patient_rows(body: bytes, content_type: str) -> List[Tuple[int, dict]]:
+    """
+    (line number, row) pairs from a CSV file with a header line, a JSON array or
+    JSON lines. Raises PatientImportError for unreadable input.
+    """
+    try:
+        text = body.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise PatientImportError("The file must be UTF-8 encoded", [], 1)
+
+    if "csv" in content_type:
+        reader = csv.DictReader(io.StringIO(text))
+        # Line 1 is the header
+        return [(line, {key: (value or "").strip() for key, value in row.items() if key}) for line, row in enumerate(reader, start=2)]
+
+    if text.lstrip().startswith("["):
+        try:
+            rows = json.loads(text)
+        except ValueError as e:
+            raise PatientImportError(f"Invalid JSON: {e}", [], 1)
+        return list(enumerate(rows, start=1))
+
+    rows = []
+    for line, raw in enumerate(text.splitlines(), start=1):
+        if not raw.strip():
+            continue
+        try:
+            rows.append((line, json.loads(raw)))
+        except ValueError as e:
+            raise PatientImportError(f"Invalid JSON on line {line}: {e}", [{"line": line, "error": str(e)}], 1)
+    return rows
+
+def validate_patient_rows(rows: List[Tuple[int, dict]]) -> List[PatientCreate]:
+    patients = []
+    errors = []
+    error_count = 0
+    for line, row in rows:
+        try:
+            if not isinstance(row, dict):
+                raise ValueError("Each row must be an object")
+            patients.append(PatientCreate(**row))
+        except ValidationError as e:
+            error_count += 1
+            if len(errors) < PATIENT_IMPORT_MAX_ERRORS:
+                message = "; ".join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors())
+                errors.append({"line": line, "error": message})
+        except ValueError as e:
+            error_count += 1
+            if len(errors) < PATIENT_IMPORT_MAX_ERRORS:
+                errors.append({"line": line, "error": str(e)})
+    if error_count:
+        raise PatientImportError(f"{error_count} invalid row(s), nothing was imported", errors, error_count)
+    if not patients:
+        raise PatientImportError("No patients found in the file", [], 1)
+    return patients
+
+def import_patients(session: Session, patients: List[PatientCreate]) -> dict:
+    """
+    Inserts the patients with executemany in batches, in one transaction, with
+    medical record numbers reserved as a single block. Medical record numbers in
+    the file are ignored because they may collide with this clinic's numbers.
+    """
+    medical_record_nos = next_medical_record_nos(session, len(patients))
+    rows = [
+        {
+            "medicalRecordNo": medical_record_no,
+            "name": patient.name,
+            "dob": patient.dob,
+            "gender": patient.gender,
+            "phone": patient.phone,
+            "address": patient.address,
+            "status": PATIENT_IMPORT_STATUS,
+        }
+        for patient, medical_record_no in zip(patients, medical_record_nos)
+    ]
+    for start in range(0, len(rows), PATIENT_IMPORT_BATCH_SIZE):
+        session.exec(insert(Patient), params=rows[start:start + PATIENT_IMPORT_BATCH_SIZE])
+    session.commit()
+
+    return {
+        "imported": len(rows),
+        "first_medical_record_no": medical_record_nos[0],
+        "last_medical_record_no": medical_record_nos[-1],
+    }
@@ -0,0 +1,307 @@
+import base64
+import json
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, or_, text
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlmodel import Session, select, func
+from models.patient import Patient
+from services.medical_records import fetch_patients_by_id
+
+# Columns in the search index, in ranking order: a match in an earlier column ranks higher
+PATIENT_SEARCH_COLUMNS = ("name", "medicalRecordNo", "phone", "address")
+PATIENT_SEARCH_MIN_LENGTH = 3 # Trigram indexes cannot match shorter terms
+PATIENT_SEARCH_RANK_WINDOW = 100 # Index matches ranked per query
+
+# Columns each sort orders by, before the id that breaks ties. Record numbers
+# outgrow their zero padding (RM999, RM1000), so shorter numbers sort first.
+PATIENT_SORT_KEYS = {
+    "id": (),
+    "name": (Patient.name,),
+    "medicalRecordNo": (func.length(Patient.medicalRecordNo), Patient.medicalRecordNo),
+}
+
+def _prefix_range(column, prefix: str):
+    """
+    `column LIKE 'prefix%'` written as a range, which SQLite can answer from the
+    column's index (its LIKE is case-insensitive and only uses NOCASE indexes).
+    """
+    return and_(column >= prefix, column < prefix + "\uffff")
+
+def _name_prefix_filter(prefix: str):
+    # Range matching is case-sensitive, so the casings a desk clerk types are combined
+    variants = {prefix, prefix.lower(), prefix.upper(), prefix.capitalize(), prefix.title()}
+    return or_(*(_prefix_range(Patient.name, variant) for variant in sorted(variants)))
+
+def _sort_values(patient: Patient, sort: str) -> list:
+    if sort == "medicalRecordNo":
+        return [len(patient.medicalRecordNo), patient.medicalRecordNo]
+    return [getattr(patient, column.key) for column in PATIENT_SORT_KEYS[sort]]
+
+def encode_patient_cursor(patient: Patient, sort: str) -> str:
+    raw = json.dumps(_sort_values(patient, sort) + [patient.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_patient_cursor(cursor: str, sort: str) -> Tuple[list, int]:
+    """Raises ValueError for malformed cursors and cursors of another sort."""
+    try:
+        *values, patient_id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        if len(values) != len(PATIENT_SORT_KEYS[sort]):
+            raise ValueError(cursor)
+        return values, int(patient_id)
+    except (ValueError, TypeError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def _after_cursor(columns: list, values: list, descending: bool):
+    """Rows behind the cursor in (columns..., id) order, compared column by column."""
+    conditions = []
+    for position, (column, value) in enumerate(zip(columns, values)):
+        equal = [earlier == earlier_value for earlier, earlier_value in zip(columns[:position], values[:position])]
+        conditions.append(and_(*equal, column < value if descending else column > value))
+    return or_(*conditions)
+
+def patient_filters(
+    name: Optional[str] = None,
+    medical_record_no: Optional[str] = None,
+    phone: Optional[str] = None,
+) -> list:
+    filters = []
+    if name:
+        filters.append(_name_prefix_filter(name))
+    if medical_record_no:
+        filters.append(_prefix_range(Patient.medicalRecordNo, medical_record_no.upper()))
+    if phone:
+        filters.append(_prefix_range(Patient.phone, phone))
+    return filters
+
+def count_patients(session: Session, filters: list) -> int:
+    return session.exec(select(func.count()).select_from(Patient).where(*filters)).one()
+
+def get_patient_page(
+    session: Session,
+    filters: list,
+    sort: str = "id",
+    order: str = "asc",
+    limit: Optional[int] = None,
+    offset: int = 0,
+    after: Optional[str] = None,
+) -> Tuple[List[Patient], Optional[str]]:
+    """
+    Return one page of patients and the cursor of the next page (None on the last page).
+    `after` continues behind a cursor (keyset pagination), otherwise `offset` is used.
+    The id breaks ties so the order is total and cursors never skip rows.
+    """
+    if sort not in PATIENT_SORT_KEYS:
+        raise ValueError(f"Invalid sort. Use one of: {', '.join(PATIENT_SORT_KEYS)}")
+    if order not in ("asc", "desc"):
+        raise ValueError("Invalid order. Use asc or desc")
+
+    columns = list(PATIENT_SORT_KEYS[sort]) + [Patient.id]
+    descending = order == "desc"
+    query = select(Patient).where(*filters)
+
+    if after:
+        cursor_values, cursor_id = decode_patient_cursor(after, sort)
+        query = query.where(_after_cursor(columns, cursor_values + [cursor_id], descending))
+    elif offset:
+        query = query.offset(offset)
+
+    query = query.order_by(*(column.desc() if descending else column.asc() for column in columns))
+
+    if limit is None:
+        return list(session.exec(query).all()), None
+
+    # Fetch one extra row to know whether another page exists
+    patients = list(session.exec(query.limit(limit + 1)).all())
+    next_cursor = encode_patient_cursor(patients[limit - 1], sort) if len(patients) > limit else None
+    return patients[:limit], next_cursor
+
+
+# --- Full-text / fuzzy search ---
+
+_SQLITE_FTS_SETUP = [
+    # External-content FTS5 table: the index stores trigrams only, rows stay in `patient`
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS patient_fts USING fts5(
+        {", ".join(PATIENT_SEARCH_COLUMNS)}, content='patient', content_rowid='id', tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS patient_fts_insert AFTER INSERT ON patient BEGIN
+        INSERT INTO patient_fts(rowid, {", ".join(PATIENT_SEARCH_COLUMNS)})
+        VALUES (new.id, {", ".join("new." + c for c in PATIENT_SEARCH_COLUMNS)});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS patient_fts_delete AFTER DELETE ON patient BEGIN
+        INSERT INTO patient_fts(patient_fts, rowid, {", ".join(PATIENT_SEARCH_COLUMNS)})
+        VALUES ('delete', old.id, {", ".join("old." + c for c in PATIENT_SEARCH_COLUMNS)});
+    END""",
+    # Only changes to indexed columns touch the index, not the frequent status updates
+    f"""CREATE TRIGGER IF NOT EXISTS patient_fts_update AFTER UPDATE OF {", ".join(PATIENT_SEARCH_COLUMNS)} ON patient BEGIN
+        INSERT INTO patient_fts(patient_fts, rowid, {", ".join(PATIENT_SEARCH_COLUMNS)})
+        VALUES ('delete', old.id, {", ".join("old." + c for c in PATIENT_SEARCH_COLUMNS)});
+        INSERT INTO patient_fts(rowid, {", ".join(PATIENT_SEARCH_COLUMNS)})
+        VALUES (new.id, {", ".join("new." + c for c in PATIENT_SEARCH_COLUMNS)});
+    END""",
+]
+
+_POSTGRES_SEARCH_TEXT = """lower(name || ' ' || "medicalRecordNo" || ' ' || phone || ' ' || address)"""
+
+_POSTGRES_TRGM_SETUP = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"CREATE INDEX IF NOT EXISTS ix_patient_search_trgm ON patient USING gin (({_POSTGRES_SEARCH_TEXT}) gin_trgm_ops)",
+]
+
+def create_patient_search_index(engine):
+    """
+    Creates the patient search index: FTS5 with the trigram tokenizer on SQLite
+    (3.34+), a pg_trgm GIN index on PostgreSQL. Triggers keep the SQLite index in
+    sync with every insert, update and delete of `patient`, including bulk writes.
+    Without support for either, search falls back to LIKE scans.
+    """
+    backend_name = engine.dialect.name
+    with engine.begin() as conn:
+        if backend_name == "sqlite":
+            exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patient_fts'")).first()
+            try:
+                for ddl in _SQLITE_FTS_SETUP:
+                    conn.execute(text(ddl))
+            except OperationalError:
+                # SQLite built without FTS5 or older than the trigram tokenizer
+                return
+            if not exists:
+                conn.execute(text("INSERT INTO patient_fts(patient_fts) VALUES ('rebuild')"))
+        elif backend_name == "postgresql":
+            try:
+                for ddl in _POSTGRES_TRGM_SETUP:
+                    conn.execute(text(ddl))
+            except DBAPIError:
+                # pg_trgm not available or the role may not create extensions
+                return
+
+def _has_fts_index(session: Session) -> bool:
+    return session.exec(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patient_fts'")).first() is not None
+
+def _has_trgm_extension(session: Session) -> bool:
+    return session.exec(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first() is not None
+
+def _fts_phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+def _word_fragments(word: str) -> List[str]:
+    """
+    A typo breaks only the trigrams around it, so either half of a longer word
+    survives a single typo; short words fall back to any of their trigrams.
+    """
+    middle = len(word) // 2
+    if middle >= PATIENT_SEARCH_MIN_LENGTH:
+        return [word[:middle], word[middle:]]
+    return [word[i:i + 3] for i in range(len(word) - 2)]
+
+def _fuzzy_fts_query(term: str, require_all_words: bool) -> Optional[str]:
+    groups = []
+    for word in term.split():
+        fragments = _word_fragments(word)
+        if fragments:
+            groups.append("(" + " OR ".join(_fts_phrase(fragment) for fragment in fragments) + ")")
+    return (" AND " if require_all_words else " OR ").join(groups) or None
+
+def _trigrams(value: str) -> set:
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+def _rank_matches(term: str, patients: List[Patient]) -> List[Patient]:
+    """
+    Substring matches first, by the first column containing the term (name before
+    record number, phone and address) and then by how much of the field the term
+    covers. Fuzzy matches follow, by the share of the term's trigrams they contain,
+    the same measure the trigram index matches on.
+    """
+    term = term.lower()
+    term_trigrams = _trigrams(term)
+
+    def rank(patient: Patient):
+        values = [str(getattr(patient, column)).lower() for column in PATIENT_SEARCH_COLUMNS]
+        for position, value in enumerate(values):
+            if term in value:
+                return 0, position, len(value)
+        return 1, -max(len(term_trigrams & _trigrams(value)) for value in values), 0
+
+    return sorted(patients, key=rank)
+
+def _fts_matches(session: Session, match: str, exclude: set) -> List[Patient]:
+    """
+    The first PATIENT_SEARCH_RANK_WINDOW matches in rowid order. SQLite's bm25()
+    counts every match of a phrase to weigh it, which costs tens of milliseconds
+    for a common street or family name, so ranking is done on this window instead.
+    """
+    query = text("SELECT rowid FROM patient_fts WHERE patient_fts MATCH :match LIMIT :window")
+    rows = session.exec(query, params={"match": match, "window": PATIENT_SEARCH_RANK_WINDOW + len(exclude)}).all()
+    ids = [row[0] for row in rows if row[0] not in exclude][:PATIENT_SEARCH_RANK_WINDOW]
+    return list(fetch_patients_by_id(session, ids).values())
+
+def _prefix_matches(session: Session, term: str, limit: int) -> List[Patient]:
+    """
+    Names, medical record numbers and phone numbers starting with the term, one
+    index range scan per casing so each query reads at most `limit` rows.
+    """
+    variants = {term, term.lower(), term.upper(), term.capitalize(), term.title()}
+    queries = [select(Patient).where(_prefix_range(Patient.name, variant)).order_by(Patient.name).limit(limit) for variant in sorted(variants)]
+    queries.append(select(Patient).where(_prefix_range(Patient.medicalRecordNo, term.upper())).order_by(Patient.medicalRecordNo).limit(limit))
+    if term.isdigit():
+        queries.append(select(Patient).where(_prefix_range(Patient.phone, term)).order_by(Patient.phone).limit(limit))
+
+    name_matches: Dict[int, Patient] = {}
+    for query in queries[:len(variants)]:
+        for patient in session.exec(query).all():
+            name_matches.setdefault(patient.id, patient)
+    matches = sorted(name_matches.values(), key=lambda patient: (patient.name, patient.id))
+    for query in queries[len(variants):]:
+        matches.extend(patient for patient in session.exec(query).all() if patient.id not in name_matches)
+    return matches[:limit]
+
+def _search_sqlite_fts(session: Session, term: str, limit: int, found: set) -> List[Patient]:
+    # Substring matches first
+    results = _rank_matches(term, _fts_matches(session, _fts_phrase(term), found))[:limit]
+
+    # Then fuzzy candidates, preferring ones that match every word
+    for require_all_words in ((True, False) if len(term.split()) > 1 else (True,)):
+        remaining = limit - len(results)
+        match = _fuzzy_fts_query(term, require_all_words)
+        if remaining <= 0 or not match:
+            break
+        excluded = found | {patient.id for patient in results}
+        results.extend(_rank_matches(term, _fts_matches(session, match, excluded))[:remaining])
+    return results
+
+def _search_postgres_trgm(session: Session, term: str, limit: int, found: set) -> List[Patient]:
+    query = text(
+        f"SELECT id FROM patient WHERE {_POSTGRES_SEARCH_TEXT} % :term OR {_POSTGRES_SEARCH_TEXT} LIKE :pattern "
+        f"ORDER BY similarity({_POSTGRES_SEARCH_TEXT}, :term) DESC LIMIT :limit"
+    )
+    rows = session.exec(query, params={"term": term.lower(), "pattern": f"%{term.lower()}%", "limit": limit + len(found)}).all()
+    ids = [row[0] for row in rows if row[0] not in found][:limit]
+    patients_by_id = fetch_patients_by_id(session, ids)
+    return [patients_by_id[patient_id] for patient_id in ids if patient_id in patients_by_id]
+
+def _search_like(session: Session, term: str, limit: int, found: set) -> List[Patient]:
+    pattern = f"%{term}%"
+    query = select(Patient).where(or_(*(getattr(Patient, column).ilike(pattern) for column in PATIENT_SEARCH_COLUMNS)))
+    if found:
+        query = query.where(Patient.id.notin_(found))
+    return list(session.exec(query.order_by(Patient.name, Patient.id).limit(limit)).all())
+
+def search_patients(session: Session, term: str, limit: int = 20) -> List[Patient]:
+    """
+    Ranked patient search over name, medical record number, phone and address:
+    prefix matches first, then substring matches, then similar spellings.
+    Terms shorter than three characters are matched as prefixes only.
+    """
+    term = term.strip()
+    results = _prefix_matches(session, term, limit)
+    remaining = limit - len(results)
+    if len(term) < PATIENT_SEARCH_MIN_LENGTH or remaining <= 0:
+        return results
+
+    found = {patient.id for patient in results}
+    backend_name = session.get_bind().dialect.name
+    if backend_name == "sqlite" and _has_fts_index(session):
+        return results + _search_sqlite_fts(session, term, remaining, found)
+    if backend_name == "postgresql" and _has_trgm_extension(session):
+        return results + _search_postgres_trgm(session, term, remaining, found)
+    return results + _search_like(session, term, remaining, found)
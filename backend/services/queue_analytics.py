@@ -0,0 +1,189 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+from sqlalchemy import literal, null, union_all
+from sqlmodel import Session, select, func, case
+from models.employee import Employee
+from models.queue import QueueStatusTransition
+from services.queue_stats import QUEUE_STATUSES
+
+# Stage times come from the transition log: a stage starts with the transition
+# into a status and ends with the entry's next transition, paired up by LEAD()
+# over each entry's transitions. Stages still in progress have no end and are
+# left out. Percentiles are nearest-rank over ROW_NUMBER() within each group.
+
+WAIT_TIME_PERCENTILES = (50, 90, 99)
+
+class StageWaitTimes(BaseModel):
+    stage: str
+    visits: int
+    avg_seconds: float
+    p50_seconds: float
+    p90_seconds: float
+    p99_seconds: float
+    max_seconds: float
+
+class HourlyThroughput(BaseModel):
+    hour: str # YYYY-MM-DD HH:00
+    arrived: int
+    completed: int
+    completed_total: int # Running total over the range
+
+class DoctorThroughput(BaseModel):
+    doctor_id: int
+    doctor_name: Optional[str] = None
+    arrived: int
+    completed: int
+    stages: List[StageWaitTimes] = []
+
+class QueueAnalytics(BaseModel):
+    start: datetime
+    end: datetime
+    stages: List[StageWaitTimes]
+    hourly: List[HourlyThroughput]
+    doctors: List[DoctorThroughput]
+
+def _seconds_between(backend_name: str, start, end):
+    if backend_name == "postgresql":
+        return func.extract("epoch", end - start)
+    return (func.julianday(end) - func.julianday(start)) * 86400.0
+
+def _hour_bucket(backend_name: str, column):
+    if backend_name == "postgresql":
+        return func.to_char(func.date_trunc("hour", column), "YYYY-MM-DD HH24:00")
+    return func.strftime("%Y-%m-%d %H:00", column)
+
+def _stage_durations(backend_name: str, start: datetime, end: datetime, doctor_id: Optional[int]):
+    """(stage, doctor_id, seconds) of the stages entered in [start, end) that have ended."""
+    entries = (
+        select(QueueStatusTransition.queue_entry_id)
+        .where(QueueStatusTransition.occurred_at >= start)
+        .where(QueueStatusTransition.occurred_at < end)
+    )
+    if doctor_id is not None:
+        entries = entries.where(QueueStatusTransition.doctor_id == doctor_id)
+    # All later transitions of those entries, even past `end`, to end their stages
+    transitions = select(
+        QueueStatusTransition.to_status.label("stage"),
+        QueueStatusTransition.doctor_id,
+        QueueStatusTransition.occurred_at.label("entered_at"),
+        func.lead(QueueStatusTransition.occurred_at).over(
+            partition_by=QueueStatusTransition.queue_entry_id,
+            order_by=(QueueStatusTransition.occurred_at, QueueStatusTransition.id),
+        ).label("left_at"),
+    ).where(QueueStatusTransition.queue_entry_id.in_(entries)).where(QueueStatusTransition.occurred_at >= start).subquery()
+
+    return select(
+        transitions.c.stage,
+        transitions.c.doctor_id,
+        _seconds_between(backend_name, transitions.c.entered_at, transitions.c.left_at).label("seconds"),
+    ).where(transitions.c.entered_at < end).where(transitions.c.left_at.is_not(None)).cte("stage_durations")
+
+def _ranked_percentiles(durations, by_doctor: bool):
+    group = [durations.c.doctor_id, durations.c.stage] if by_doctor else [durations.c.stage]
+    ranked = select(
+        *group,
+        durations.c.seconds,
+        func.row_number().over(partition_by=group, order_by=durations.c.seconds).label("rn"),
+        func.count().over(partition_by=group).label("n"),
+    ).subquery()
+
+    percentiles = [
+        func.min(case((ranked.c.rn >= ranked.c.n * (percentile / 100.0), ranked.c.seconds)))
+        for percentile in WAIT_TIME_PERCENTILES
+    ]
+    return select(
+        literal(by_doctor).label("by_doctor"),
+        ranked.c.doctor_id if by_doctor else null(),
+        ranked.c.stage,
+        func.count(),
+        func.avg(ranked.c.seconds),
+        *percentiles,
+        func.max(ranked.c.seconds),
+    ).group_by(*[ranked.c[column.name] for column in group])
+
+def _stage_wait_times(session: Session, durations) -> Tuple[List[StageWaitTimes], Dict[int, List[StageWaitTimes]]]:
+    """Overall and per-doctor stage wait times in one statement, so the stages are paired up once."""
+    rows = session.exec(union_all(_ranked_percentiles(durations, False), _ranked_percentiles(durations, True))).all()
+
+    stages: List[StageWaitTimes] = []
+    doctor_stages: Dict[int, List[StageWaitTimes]] = {}
+    stage_order = {status: position for position, status in enumerate(QUEUE_STATUSES)}
+    for by_doctor, doctor_id, stage, visits, avg_seconds, p50, p90, p99, max_seconds in sorted(rows, key=lambda row: stage_order.get(row[2], len(stage_order))):
+        wait_times = StageWaitTimes(
+            stage=stage,
+            visits=visits,
+            avg_seconds=avg_seconds,
+            p50_seconds=p50,
+            p90_seconds=p90,
+            p99_seconds=p99,
+            max_seconds=max_seconds,
+        )
+        if not by_doctor:
+            stages.append(wait_times)
+        elif doctor_id is not None:
+            doctor_stages.setdefault(doctor_id, []).append(wait_times)
+    return stages, doctor_stages
+
+def _hourly_throughput(session: Session, backend_name: str, start: datetime, end: datetime, doctor_id: Optional[int]) -> List[HourlyThroughput]:
+    hour = _hour_bucket(backend_name, QueueStatusTransition.occurred_at).label("hour")
+    arrived = func.sum(case((QueueStatusTransition.from_status.is_(None), 1), else_=0))
+    completed = func.sum(case((QueueStatusTransition.to_status == "selesai", 1), else_=0))
+    query = (
+        select(hour, arrived, completed, func.sum(completed).over(order_by=hour))
+        .where(QueueStatusTransition.occurred_at >= start)
+        .where(QueueStatusTransition.occurred_at < end)
+    )
+    if doctor_id is not None:
+        query = query.where(QueueStatusTransition.doctor_id == doctor_id)
+    rows = session.exec(query.group_by(hour).order_by(hour)).all()
+    return [
+        HourlyThroughput(hour=hour, arrived=arrived, completed=completed, completed_total=total)
+        for hour, arrived, completed, total in rows
+    ]
+
+def _doctor_counts(session: Session, start: datetime, end: datetime, doctor_id: Optional[int]):
+    query = (
+        select(
+            QueueStatusTransition.doctor_id,
+            Employee.name,
+            func.sum(case((QueueStatusTransition.from_status.is_(None), 1), else_=0)),
+            func.sum(case((QueueStatusTransition.to_status == "selesai", 1), else_=0)),
+        )
+        .outerjoin(Employee, Employee.id == QueueStatusTransition.doctor_id)
+        .where(QueueStatusTransition.occurred_at >= start)
+        .where(QueueStatusTransition.occurred_at < end)
+        .where(QueueStatusTransition.doctor_id.is_not(None))
+    )
+    if doctor_id is not None:
+        query = query.where(QueueStatusTransition.doctor_id == doctor_id)
+    return session.exec(query.group_by(QueueStatusTransition.doctor_id, Employee.name).order_by(QueueStatusTransition.doctor_id)).all()
+
+def get_queue_analytics(session: Session, start: datetime, end: datetime, doctor_id: Optional[int] = None) -> QueueAnalytics:
+    """
+    Stage wait-time percentiles, hourly arrivals/completions and per-doctor
+    throughput for the half-open range [start, end), from QueueStatusTransition.
+    """
+    backend_name = session.get_bind().dialect.name
+    durations = _stage_durations(backend_name, start, end, doctor_id)
+    stages, doctor_stages = _stage_wait_times(session, durations)
+
+    doctors = [
+        DoctorThroughput(
+            doctor_id=row_doctor_id,
+            doctor_name=name,
+            arrived=arrived,
+            completed=completed,
+            stages=doctor_stages.get(row_doctor_id, []),
+        )
+        for row_doctor_id, name, arrived, completed in _doctor_counts(session, start, end, doctor_id)
+    ]
+
+    return QueueAnalytics(
+        start=start,
+        end=end,
+        stages=stages,
+        hourly=_hourly_throughput(session, backend_name, start, end, doctor_id),
+        doctors=doctors,
+    )
@@ -0,0 +1,151 @@
+import asyncio
+import itertools
+import random
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Deque, Optional, Set
+
+from pydantic import BaseModel, Field
+from models.queue import QueueEntry
+from services.table_versions import local_table_versions
+
+QUEUE_EVENT_HISTORY_SIZE = 500 # Events kept for clients reconnecting with Last-Event-ID
+QUEUE_EVENT_SUBSCRIBER_BUFFER = 1000 # Pending events per subscriber before it is dropped
+QUEUE_TABLE = QueueEntry.__tablename__
+
+class QueueEvent(BaseModel):
+    id: int = 0 # Assigned by the bus, increasing; see QueueEventBus
+    type: str # created, status_changed, deleted
+    queue_id: int
+    patient_id: int
+    patient_name: str
+    medicalRecordNo: Optional[str] = None
+    doctor_id: Optional[int] = None
+    status: Optional[str] = None # None once the entry is deleted
+    previous_status: Optional[str] = None
+    occurred_at: datetime = Field(default_factory=datetime.now)
+    # Queue table version this process had reached when publishing; not sent to clients
+    table_version: int = Field(default=0, exclude=True)
+
+    def matches(self, status: Optional[str] = None, doctor_id: Optional[int] = None) -> bool:
+        """An entry leaving the filtered status is reported too, so screens can drop it."""
+        if doctor_id is not None and self.doctor_id != doctor_id:
+            return False
+        if status is not None and status not in (self.status, self.previous_status):
+            return False
+        return True
+
+def queue_event(event_type: str, queue_entry: QueueEntry, previous_status: Optional[str] = None) -> QueueEvent:
+    return QueueEvent(
+        type=event_type,
+        queue_id=queue_entry.id,
+        patient_id=queue_entry.patient_id,
+        patient_name=queue_entry.patient_name,
+        medicalRecordNo=queue_entry.medicalRecordNo,
+        doctor_id=queue_entry.doctor_id,
+        status=None if event_type == "deleted" else queue_entry.status,
+        previous_status=previous_status,
+    )
+
+class QueueSubscription:
+    def __init__(self, loop: asyncio.AbstractEventLoop, status: Optional[str], doctor_id: Optional[int]):
+        self.loop = loop
+        self.status = status
+        self.doctor_id = doctor_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_EVENT_SUBSCRIBER_BUFFER)
+        self.overflowed = False
+        # Table version of the Last-Event-ID event, when it was replayed from the history
+        self.table_version: Optional[int] = None
+
+    def _deliver(self, event: QueueEvent):
+        # Runs on the subscriber's event loop
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A client that stopped reading gets disconnected instead of growing without bound
+            self.overflowed = True
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def get(self) -> Optional[QueueEvent]:
+        """Next matching event; None means the subscriber fell behind and must resync."""
+        return await self.queue.get()
+
+class QueueEventBus:
+    """
+    In-process publish/subscribe of queue status changes.
+
+    Write paths publish after their commit, from async endpoints or from sync
+    endpoints running in the threadpool. Events only reach subscribers of this
+    process, so clients must still load GET /queue/ once when they connect.
+
+    Ids start at a random base per process, so an id of an earlier process or of
+    another worker is not found in the history and a client reconnecting with it
+    is told to resync instead of missing events. Changes made by other workers
+    are detected from the queue table version (routers.queue).
+    """
+
+    def __init__(self, history_size: int = QUEUE_EVENT_HISTORY_SIZE):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(random.randrange(1, 2 ** 52))
+        self._last_id = 0
+        self._history: Deque[QueueEvent] = deque(maxlen=history_size)
+        self._subscribers: Set[QueueSubscription] = set()
+        self.published = 0
+
+    def publish(self, event: QueueEvent) -> QueueEvent:
+        with self._lock:
+            event.id = self._last_id = next(self._ids)
+            event.table_version = local_table_versions.latest(QUEUE_TABLE)
+            self._history.append(event)
+            self.published += 1
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            if event.matches(subscription.status, subscription.doctor_id):
+                try:
+                    subscription.loop.call_soon_threadsafe(subscription._deliver, event)
+                except RuntimeError:
+                    # The subscriber's loop is closed; it is removed on unsubscribe
+                    pass
+        return event
+
+    def subscribe(self, status: Optional[str] = None, doctor_id: Optional[int] = None, last_event_id: Optional[int] = None) -> QueueSubscription:
+        """Must be called from the event loop that will consume the events."""
+        subscription = QueueSubscription(asyncio.get_running_loop(), status, doctor_id)
+        with self._lock:
+            if last_event_id is not None:
+                self._replay(subscription, last_event_id)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def _replay(self, subscription: QueueSubscription, last_event_id: int):
+        """
+        Delivers the events after `last_event_id`, or a resync when that event is
+        not in the history: rotated out, or from another process. Caller holds the lock.
+        """
+        position = next((i for i, event in enumerate(self._history) if event.id == last_event_id), None)
+        if position is None:
+            subscription._deliver(None)
+            return
+        subscription.table_version = self._history[position].table_version
+        for event in list(self._history)[position + 1:]:
+            if event.matches(subscription.status, subscription.doctor_id):
+                subscription._deliver(event)
+
+    def unsubscribe(self, subscription: QueueSubscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "subscribers": len(self._subscribers),
+                "published": self.published,
+                "history_size": len(self._history),
+                "last_event_id": self._last_id,
+            }
+
+queue_event_bus = QueueEventBus()
@@ -0,0 +1,57 @@
+from datetime import datetime
+from typing import Dict, Optional
+
+from pydantic import BaseModel, Field
+from sqlalchemy import literal
+from sqlmodel import Session, select, func, case
+from models.queue import QueueEntry
+
+QUEUE_STATUSES = ("menunggu", "diperiksa", "apotek", "membayar", "selesai")
+ACTIVE_QUEUE_STATUSES = tuple(status for status in QUEUE_STATUSES if status != "selesai")
+
+def active_queue_filter():
+    """
+    Matches ACTIVE_QUEUE_CONDITION of the partial active-queue indexes. The value
+    is inlined so the planner can prove the index condition at prepare time.
+    """
+    return QueueEntry.status != literal("selesai", literal_execute=True)
+
+def _empty_counts() -> Dict[str, int]:
+    return {status: 0 for status in QUEUE_STATUSES}
+
+class QueueStatusCounts(BaseModel):
+    """Per-status queue counts, all-time and for entries created since a given moment."""
+    total: Dict[str, int] = Field(default_factory=_empty_counts)
+    since: Dict[str, int] = Field(default_factory=_empty_counts)
+
+    @property
+    def active(self) -> int:
+        return sum(count for status, count in self.total.items() if status != "selesai")
+
+    @property
+    def created_since(self) -> int:
+        return sum(self.since.values())
+
+def _status_count_query(since: Optional[datetime]):
+    created_since = case((QueueEntry.created_at >= since, 1), else_=0) if since else 0
+    return select(
+        QueueEntry.status,
+        func.count(),
+        func.coalesce(func.sum(created_since), 0)
+    )
+
+def get_queue_status_counts(session: Session, doctor_id: Optional[int] = None, since: Optional[datetime] = None) -> QueueStatusCounts:
+    """
+    Count queue entries per status with a single GROUP BY query.
+    Served from the (doctor_id, status) index when filtered by doctor.
+    """
+    query = _status_count_query(since)
+    if doctor_id is not None:
+        query = query.where(QueueEntry.doctor_id == doctor_id)
+    query = query.group_by(QueueEntry.status)
+
+    counts = QueueStatusCounts()
+    for status, total, created_since in session.exec(query).all():
+        counts.total[status] = total
+        counts.since[status] = created_since
+    return counts
@@ -0,0 +1,198 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pydantic import BaseModel
+from sqlalchemy import and_
+from sqlmodel import Session, select, update, insert, func
+from models.patient import Patient
+from models.queue import QueueEntry, QueueStatusTransition
+from services.queue_events import QueueEvent, queue_event, queue_event_bus
+from services.queue_stats import QUEUE_STATUSES
+
+# Allowed status changes of a visit. Forward steps plus the one-step corrections
+# the desks need; a finished visit ("selesai") is never reopened. Setting the
+# current status again is always allowed and changes nothing.
+QUEUE_TRANSITIONS: Dict[str, frozenset] = {
+    "menunggu": frozenset({"diperiksa", "apotek", "selesai"}),
+    "diperiksa": frozenset({"menunggu", "apotek", "membayar", "selesai"}),
+    "apotek": frozenset({"diperiksa", "membayar", "selesai"}),
+    "membayar": frozenset({"apotek", "selesai"}),
+    "selesai": frozenset(),
+}
+
+class QueueWorkflowError(Exception):
+    status_code = 400
+
+class QueueEntryNotFoundError(QueueWorkflowError):
+    status_code = 404
+
+class InvalidTransitionError(QueueWorkflowError):
+    status_code = 409
+
+class QueueTransition(BaseModel):
+    queue_id: int
+    patient_id: int
+    from_status: str
+    to_status: str
+    event: QueueEvent
+
+class QueueTransitionBatch(BaseModel):
+    transitions: List[QueueTransition] = []
+    skipped: Dict[int, str] = {} # queue id -> reason
+
+def allowed_sources(to_status: str) -> List[str]:
+    return [status for status, targets in QUEUE_TRANSITIONS.items() if to_status in targets]
+
+def _check_status(to_status: str):
+    if to_status not in QUEUE_STATUSES:
+        raise QueueWorkflowError(f"Invalid status. Valid statuses: {', '.join(sorted(QUEUE_STATUSES))}")
+
+def transition_entries(session: Session, entries: Sequence[QueueEntry], to_status: str, force: bool = False) -> QueueTransitionBatch:
+    """
+    Moves the given (loaded) queue entries to `to_status` with one compare-and-set
+    UPDATE of QueueEntry and one UPDATE of Patient, and appends the changes to
+    QueueStatusTransition. Entries whose status does not
+    allow the change, or that changed concurrently, are skipped and reported;
+    `force` allows any change (manual corrections). The caller commits and then
+    calls publish_transitions().
+
+    Patient.status mirrors the patient's latest visit, so patients whose latest
+    visit is not among the moved entries keep their status.
+    """
+    _check_status(to_status)
+    batch = QueueTransitionBatch()
+    sources = set(QUEUE_STATUSES if force else allowed_sources(to_status)) - {to_status}
+
+    candidates = {}
+    for entry in entries:
+        if entry.status == to_status:
+            continue
+        if entry.status not in sources:
+            batch.skipped[entry.id] = f"Cannot change status from '{entry.status}' to '{to_status}'"
+            continue
+        candidates[entry.id] = entry
+    if not candidates:
+        return batch
+
+    now = datetime.now()
+    # Read before the UPDATE: synchronizing the session overwrites the status
+    previous = {queue_id: entry.status for queue_id, entry in candidates.items()}
+
+    # Compare-and-set on the allowed source statuses; RETURNING tells which rows
+    # moved, and the loaded entries are synchronized without another SELECT
+    moved_ids = set(session.exec(
+        update(QueueEntry)
+        .where(QueueEntry.id.in_(list(candidates)))
+        .where(QueueEntry.status.in_(sources))
+        .values(status=to_status, status_changed_at=now)
+        .returning(QueueEntry.id)
+    ).scalars().all())
+    for queue_id in candidates:
+        if queue_id not in moved_ids:
+            batch.skipped[queue_id] = "Status changed concurrently"
+    if not moved_ids:
+        return batch
+
+    latest_visit = (
+        select(func.max(QueueEntry.id))
+        .where(QueueEntry.patient_id == Patient.id)
+        .scalar_subquery()
+    )
+    session.exec(
+        update(Patient)
+        .where(Patient.id.in_({candidates[queue_id].patient_id for queue_id in moved_ids}))
+        .where(latest_visit.in_(list(moved_ids)))
+        .values(status=to_status)
+    )
+
+    session.exec(insert(QueueStatusTransition), params=[
+        {
+            "queue_entry_id": queue_id,
+            "patient_id": candidates[queue_id].patient_id,
+            "doctor_id": candidates[queue_id].doctor_id,
+            "from_status": previous[queue_id],
+            "to_status": to_status,
+            "occurred_at": now,
+        }
+        for queue_id in sorted(moved_ids)
+    ])
+
+    for queue_id in sorted(moved_ids):
+        entry = candidates[queue_id]
+        from_status = previous[queue_id]
+        batch.transitions.append(QueueTransition(
+            queue_id=queue_id,
+            patient_id=entry.patient_id,
+            from_status=from_status,
+            to_status=to_status,
+            event=queue_event("status_changed", entry, from_status),
+        ))
+    return batch
+
+def record_queue_entry_created(session: Session, entry: QueueEntry):
+    """Starts the transition log of a new (flushed) entry, so its first stage can be timed."""
+    session.add(QueueStatusTransition(
+        queue_entry_id=entry.id,
+        patient_id=entry.patient_id,
+        doctor_id=entry.doctor_id,
+        to_status=entry.status,
+        occurred_at=entry.created_at,
+    ))
+
+def transition_entry(session: Session, entry: QueueEntry, to_status: str, force: bool = False, strict: bool = True) -> Optional[QueueTransition]:
+    """
+    Single-entry variant of transition_entries. With `strict` an invalid change
+    raises InvalidTransitionError; without it the entry is left as it is, which
+    suits transitions that follow a recorded fact (payment, handed-out drugs).
+    Returns None when nothing changed.
+    """
+    batch = transition_entries(session, [entry], to_status, force)
+    if strict and entry.id in batch.skipped:
+        raise InvalidTransitionError(batch.skipped[entry.id])
+    return batch.transitions[0] if batch.transitions else None
+
+def transition_queue_entry(session: Session, queue_id: int, to_status: str, force: bool = False) -> Tuple[QueueEntry, Optional[QueueTransition]]:
+    """Loads the entry by primary key and applies a strict transition."""
+    _check_status(to_status)
+    entry = session.get(QueueEntry, queue_id)
+    if not entry:
+        raise QueueEntryNotFoundError("Queue entry not found")
+    return entry, transition_entry(session, entry, to_status, force)
+
+def transition_matching(
+    session: Session,
+    to_status: str,
+    queue_ids: Optional[List[int]] = None,
+    from_statuses: Optional[List[str]] = None,
+    doctor_id: Optional[int] = None,
+    created_before: Optional[datetime] = None,
+    force: bool = False,
+) -> QueueTransitionBatch:
+    """Batch transition of the entries matching the filters, e.g. closing yesterday's stale visits."""
+    filters = []
+    if queue_ids is not None:
+        filters.append(QueueEntry.id.in_(queue_ids))
+    if from_statuses:
+        filters.append(QueueEntry.status.in_(from_statuses))
+    if doctor_id is not None:
+        filters.append(QueueEntry.doctor_id == doctor_id)
+    if created_before is not None:
+        filters.append(QueueEntry.created_at < created_before)
+    if not filters:
+        raise QueueWorkflowError("At least one filter is required")
+
+    entries = session.exec(select(QueueEntry).where(and_(*filters)).order_by(QueueEntry.id)).all()
+    batch = transition_entries(session, entries, to_status, force)
+    if queue_ids is not None:
+        found = {entry.id for entry in entries}
+        for queue_id in queue_ids:
+            if queue_id not in found:
+                batch.skipped[queue_id] = "Queue entry not found"
+    return batch
+
+def publish_transitions(transitions: Sequence[Optional[QueueTransition]]):
+    """Call after commit: publishes the queue events."""
+    for transition in transitions:
+        if transition is None:
+            continue
+        queue_event_bus.publish(transition.event)
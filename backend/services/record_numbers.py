@@ -0,0 +1,115 @@
+import os
+import threading
+from typing import List
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+from models.patient import Patient
+from models.sequence import SequenceCounter
+
+MEDICAL_RECORD_SEQUENCE = "medical_record_no"
+MEDICAL_RECORD_PREFIX = "RM"
+# Zero padding of new numbers; numbers past the width simply grow (RM999 -> RM1000)
+MEDICAL_RECORD_NO_DIGITS = int(os.getenv("MEDICAL_RECORD_NO_DIGITS", "3"))
+# Numbers reserved per database round trip; unused ones are skipped when the process stops
+MEDICAL_RECORD_BLOCK_SIZE = int(os.getenv("MEDICAL_RECORD_BLOCK_SIZE", "10"))
+
+def format_medical_record_no(number: int) -> str:
+    return f"{MEDICAL_RECORD_PREFIX}{number:0{MEDICAL_RECORD_NO_DIGITS}d}"
+
+def parse_medical_record_no(medical_record_no: str) -> int:
+    """Raises ValueError for numbers not in the RM<digits> format."""
+    if not medical_record_no.startswith(MEDICAL_RECORD_PREFIX):
+        raise ValueError(f"Invalid medical record number: {medical_record_no}")
+    return int(medical_record_no[len(MEDICAL_RECORD_PREFIX):])
+
+class SequenceAllocator:
+    """
+    Hands out increasing numbers of a named SequenceCounter.
+
+    Blocks are reserved with a single `UPDATE ... SET value = value + n RETURNING
+    value` in a transaction of its own, committed at once, so concurrent desks
+    and workers never receive the same number and never wait on each other's
+    request transaction. Numbers of a block come from memory under a lock.
+    A rolled back registration or a restart leaves gaps, which is expected.
+    """
+
+    def __init__(self, name: str, block_size: int):
+        self.name = name
+        self.block_size = max(block_size, 1)
+        self._lock = threading.Lock()
+        self._blocks: List[List[int]] = [] # Reserved [next, end) ranges not used up yet
+
+    def _reserve_block(self, session: Session, size: int) -> List[int]:
+        """[start, end) of a newly reserved block."""
+        bind = session.get_bind()
+        with bind.engine.begin() as conn:
+            end = conn.execute(
+                update(SequenceCounter)
+                .where(SequenceCounter.name == self.name)
+                .values(value=SequenceCounter.value + size)
+                .returning(SequenceCounter.value)
+            ).scalar_one_or_none()
+        if end is None:
+            raise RuntimeError(f"Sequence '{self.name}' is missing; it is created by create_db_and_tables()")
+        return [end - size + 1, end + 1]
+
+    def _take(self, values: List[int], count: int):
+        # Caller holds the lock
+        while self._blocks and len(values) < count:
+            block = self._blocks[0]
+            take = min(count - len(values), block[1] - block[0])
+            values.extend(range(block[0], block[0] + take))
+            block[0] += take
+            if block[0] >= block[1]:
+                self._blocks.pop(0)
+
+    def next_values(self, session: Session, count: int = 1) -> List[int]:
+        """
+        Large requests (bulk imports) reserve everything they need in one block.
+        The lock is never held during the reservation, so a request waiting on
+        the database never holds up others that still have numbers in memory.
+        Blocks reserved concurrently are all kept, so racing requests leave no gaps.
+        """
+        values: List[int] = []
+        with self._lock:
+            self._take(values, count)
+        while len(values) < count:
+            block = self._reserve_block(session, max(self.block_size, count - len(values)))
+            with self._lock:
+                self._blocks.append(block)
+                self._take(values, count)
+        return values
+
+    def next_value(self, session: Session) -> int:
+        return self.next_values(session, 1)[0]
+
+medical_record_numbers = SequenceAllocator(MEDICAL_RECORD_SEQUENCE, MEDICAL_RECORD_BLOCK_SIZE)
+
+def next_medical_record_no(session: Session) -> str:
+    return format_medical_record_no(medical_record_numbers.next_value(session))
+
+def next_medical_record_nos(session: Session, count: int) -> List[str]:
+    return [format_medical_record_no(number) for number in medical_record_numbers.next_values(session, count)]
+
+def create_medical_record_sequence(engine):
+    """
+    Creates the medical record number counter, starting after the highest number
+    already in use. Patient is read only here, once, when the counter is missing.
+    """
+    with Session(engine) as session:
+        if session.get(SequenceCounter, MEDICAL_RECORD_SEQUENCE):
+            return
+        highest = 0
+        for medical_record_no in session.exec(select(Patient.medicalRecordNo)).all():
+            try:
+                highest = max(highest, parse_medical_record_no(medical_record_no))
+            except ValueError:
+                continue
+        session.add(SequenceCounter(name=MEDICAL_RECORD_SEQUENCE, value=highest))
+        try:
+            session.commit()
+        except IntegrityError:
+            # Created concurrently by another worker starting up
+            session.rollback()
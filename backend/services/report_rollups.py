@@ -0,0 +1,117 @@
+import json
+from datetime import date, timedelta
+from typing import Dict, List, Set
+
+from pydantic import BaseModel
+from sqlmodel import Session, select, func
+from sqlalchemy.exc import IntegrityError
+from models.report import ReportSummary, DailyReportRollup, Examination, Prescription
+from models.payment import Payment
+from models.drug import Drug
+from utils.helpers import date_range_filter
+
+class DayTotals(BaseModel):
+    total_income: int = 0
+    patient_ids: Set[int] = set()
+    drugs_used: Dict[str, int] = {}
+
+def _days(first_day: date, last_day: date) -> List[date]:
+    return [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+
+def compute_day_totals(session: Session, first_day: date, last_day: date) -> Dict[str, DayTotals]:
+    """
+    Aggregate payments per day for first_day..last_day (inclusive) straight from the
+    payment tables: three GROUP BY queries regardless of how many days or payments.
+    """
+    day = func.date(Payment.payment_date)
+    in_range = date_range_filter(Payment.payment_date, first_day, last_day)
+
+    totals = {d.isoformat(): DayTotals(patient_ids=set(), drugs_used={}) for d in _days(first_day, last_day)}
+
+    # 1. Income per day
+    for payment_day, income in session.exec(
+        select(day, func.sum(Payment.total_amount)).where(*in_range).group_by(day)
+    ).all():
+        totals[str(payment_day)].total_income = income or 0
+
+    # 2. Distinct patients of the examinations paid each day
+    for payment_day, patient_id in session.exec(
+        select(day, Examination.patient_id)
+        .join(Examination, Examination.id == Payment.examination_id)
+        .where(*in_range)
+        .distinct()
+    ).all():
+        totals[str(payment_day)].patient_ids.add(patient_id)
+
+    # 3. Drugs used by the examinations paid each day
+    for payment_day, drug_name, quantity in session.exec(
+        select(day, Drug.nama, func.sum(Prescription.quantity))
+        .join(Prescription, Prescription.examination_id == Payment.examination_id)
+        .join(Drug, Drug.id == Prescription.drug_id)
+        .where(*in_range)
+        .group_by(day, Drug.nama)
+    ).all():
+        totals[str(payment_day)].drugs_used[drug_name] = quantity
+
+    return totals
+
+def _from_rollup(rollup: DailyReportRollup) -> DayTotals:
+    return DayTotals(
+        total_income=rollup.total_income,
+        patient_ids=set(json.loads(rollup.patient_ids)),
+        drugs_used=json.loads(rollup.drugs_used)
+    )
+
+def get_day_totals(session: Session, first_day: date, last_day: date, refresh: bool = False) -> Dict[str, DayTotals]:
+    """
+    Per-day totals for first_day..last_day. Closed days (before today) are read from
+    DailyReportRollup and computed once if missing; today and later are always
+    computed fresh because payments can still be recorded. `refresh` recomputes
+    every day and overwrites the stored rollups, e.g. after a payment was corrected.
+    """
+    today = date.today()
+    stored = {
+        r.day: r for r in session.exec(
+            select(DailyReportRollup)
+            .where(DailyReportRollup.day >= first_day.isoformat())
+            .where(DailyReportRollup.day <= last_day.isoformat())
+        ).all()
+    }
+    totals = {day: _from_rollup(rollup) for day, rollup in stored.items()}
+
+    missing = [d for d in _days(first_day, last_day) if refresh or d.isoformat() not in stored or d >= today]
+    if missing:
+        computed = compute_day_totals(session, missing[0], missing[-1])
+        for d in missing:
+            day_totals = computed[d.isoformat()]
+            totals[d.isoformat()] = day_totals
+            if d < today:
+                session.merge(DailyReportRollup(
+                    day=d.isoformat(),
+                    total_income=day_totals.total_income,
+                    patient_ids=json.dumps(sorted(day_totals.patient_ids)),
+                    drugs_used=json.dumps(day_totals.drugs_used)
+                ))
+        try:
+            session.commit()
+        except IntegrityError:
+            # Another request stored the same closed day first; its values are identical
+            session.rollback()
+    return totals
+
+def build_report_summary(session: Session, first_day: date, last_day: date, refresh: bool = False) -> ReportSummary:
+    """Compose a ReportSummary for first_day..last_day from per-day totals; see get_day_totals for `refresh`."""
+    total_income = 0
+    patient_ids = set()
+    drugs_used = {}
+    for day_totals in get_day_totals(session, first_day, last_day, refresh).values():
+        total_income += day_totals.total_income
+        patient_ids |= day_totals.patient_ids
+        for drug_name, quantity in day_totals.drugs_used.items():
+            drugs_used[drug_name] = drugs_used.get(drug_name, 0) + quantity
+
+    return ReportSummary(
+        total_patients=len(patient_ids),
+        total_income=total_income,
+        drugs_used=drugs_used
+    )
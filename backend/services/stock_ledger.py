@@ -0,0 +1,131 @@
+from collections import defaultdict
+from typing import Dict, List
+
+from sqlmodel import Session, select, update, case
+from models.drug import Drug, StockMovement
+from models.report import Prescription
+
+# Stock changes are applied with conditional UPDATE statements rather than
+# read-modify-write in Python, so concurrent pharmacy counters cannot
+# oversell or lose updates. Every change is appended to StockMovement in the
+# same transaction. The caller commits.
+
+class StockLedgerError(Exception):
+    status_code = 400
+
+class DrugNotFoundError(StockLedgerError):
+    status_code = 404
+
+class InsufficientStockError(StockLedgerError):
+    status_code = 400
+
+class PrescriptionAlreadyFulfilledError(StockLedgerError):
+    status_code = 409
+
+def _no_sync(statement):
+    # Core-style UPDATE; callers refresh the ORM objects they return
+    return statement.execution_options(synchronize_session=False)
+
+def fulfill_prescriptions(session: Session, prescriptions: List[Prescription]) -> None:
+    """
+    Mark the given prescriptions as 'selesai' and take their drugs out of stock.
+    Uses one UPDATE to claim the prescriptions and one UPDATE to decrement all
+    drugs of the batch. On any failure the transaction is rolled back and a
+    StockLedgerError is raised, so no partial decrement is left behind.
+    """
+    if not prescriptions:
+        return
+
+    # 1. Claim the prescriptions; a concurrent fulfilment makes the rowcount fall short
+    prescription_ids = [p.id for p in prescriptions]
+    claimed = session.exec(_no_sync(
+        update(Prescription)
+        .where(Prescription.id.in_(prescription_ids))
+        .where(Prescription.status != "selesai")
+        .values(status="selesai")
+    )).rowcount
+    if claimed != len(prescription_ids):
+        session.rollback()
+        raise PrescriptionAlreadyFulfilledError("Prescription already fulfilled")
+
+    # 2. Decrement every drug of the batch in a single conditional UPDATE
+    quantities: Dict[int, int] = defaultdict(int)
+    for pres in prescriptions:
+        quantities[pres.drug_id] += pres.quantity
+    quantity_for_drug = case(quantities, value=Drug.id)
+    decremented = session.exec(_no_sync(
+        update(Drug)
+        .where(Drug.id.in_(list(quantities)))
+        .where(Drug.stok >= quantity_for_drug)
+        .values(stok=Drug.stok - quantity_for_drug)
+    )).rowcount
+    if decremented != len(quantities):
+        error = _stock_error(session, quantities)
+        session.rollback()
+        raise error
+
+    session.add_all([
+        StockMovement(drug_id=pres.drug_id, change=-pres.quantity, reason="resep", prescription_id=pres.id)
+        for pres in prescriptions
+    ])
+
+def _stock_error(session: Session, quantities: Dict[int, int]) -> StockLedgerError:
+    drugs = {d.id: d for d in session.exec(select(Drug).where(Drug.id.in_(list(quantities)))).all()}
+    for drug_id, required in quantities.items():
+        drug = drugs.get(drug_id)
+        if not drug:
+            return DrugNotFoundError(f"Drug in prescription not found in stock: {drug_id}")
+        # The failed UPDATE changed nothing for this drug, so stok is the available amount
+        if drug.stok < required:
+            return InsufficientStockError(f"Not enough stock for {drug.nama}. Required: {required}, available: {drug.stok}")
+    return StockLedgerError("Stock changed concurrently, please retry")
+
+def adjust_stock(session: Session, drug_id: int, change: int, reason: str = "penyesuaian") -> int:
+    """
+    Add `change` (may be negative) to a drug's stock, clamping at zero.
+    Returns the change that was actually applied.
+    """
+    updated = session.exec(_no_sync(
+        update(Drug)
+        .where(Drug.id == drug_id)
+        .where(Drug.stok + change >= 0)
+        .values(stok=Drug.stok + change)
+    )).rowcount
+    if updated:
+        if change:
+            session.add(StockMovement(drug_id=drug_id, change=change, reason=reason))
+        return change
+
+    if not _drug_exists(session, drug_id):
+        raise DrugNotFoundError("Drug not found")
+    # Not enough stock to remove: drop to zero, as stock never goes negative
+    observed = set_stock(session, drug_id, 0, reason)
+    return -observed
+
+def set_stock(session: Session, drug_id: int, new_stok: int, reason: str = "penyesuaian") -> int:
+    """
+    Set a drug's stock to an absolute value with a compare-and-set UPDATE,
+    recording the difference. Returns the stock level that was replaced.
+    """
+    while True:
+        observed = session.exec(select(Drug.stok).where(Drug.id == drug_id)).first()
+        if observed is None:
+            raise DrugNotFoundError("Drug not found")
+        swapped = session.exec(_no_sync(
+            update(Drug)
+            .where(Drug.id == drug_id)
+            .where(Drug.stok == observed)
+            .values(stok=new_stok)
+        )).rowcount
+        if swapped:
+            if new_stok != observed:
+                session.add(StockMovement(drug_id=drug_id, change=new_stok - observed, reason=reason))
+            return observed
+
+def record_initial_stock(session: Session, drug: Drug) -> None:
+    """Ledger entry for a newly created drug; call after it has been flushed."""
+    if drug.stok:
+        session.add(StockMovement(drug_id=drug.id, change=drug.stok, reason="stok_awal"))
+
+def _drug_exists(session: Session, drug_id: int) -> bool:
+    return session.exec(select(Drug.id).where(Drug.id == drug_id)).first() is not None
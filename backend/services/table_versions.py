@@ -0,0 +1,166 @@
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional
+
+from fastapi import Depends, HTTPException, Request, Response
+from sqlalchemy import event, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session as OrmSession
+from sqlmodel import Session, SQLModel, select
+from models.table_version import TableVersion
+
+# Change counter per table in the TableVersion table, bumped in the transaction
+# of every commit that wrote to the table. Writes are picked up from the ORM
+# session events below (flushed objects and update()/delete()/insert()
+# statements), so routers need no explicit calls. Being rows in the database,
+# the versions are shared by all workers and move exactly with the data.
+
+LOCAL_TABLE_VERSION_HISTORY = 1000 # Versions remembered per table by LocalTableVersions
+
+class LocalTableVersions:
+    """
+    The versions produced by commits of this process, per table. A reader that
+    saw the version move can tell whether the writes came from this process,
+    whose in-process notifications it received, or from another worker.
+    """
+
+    def __init__(self, history_size: int = LOCAL_TABLE_VERSION_HISTORY):
+        self.history_size = history_size
+        self._lock = threading.Lock()
+        self._versions: Dict[str, Deque[int]] = {}
+
+    def record(self, versions: Dict[str, int]):
+        with self._lock:
+            for table_name, version in versions.items():
+                self._versions.setdefault(table_name, deque(maxlen=self.history_size)).append(version)
+
+    def latest(self, table_name: str) -> int:
+        with self._lock:
+            versions = self._versions.get(table_name)
+            return versions[-1] if versions else 0
+
+    def covers(self, table_name: str, since: int, current: int) -> bool:
+        """Whether every version after `since` up to `current` was produced by this process."""
+        if current <= since:
+            return True
+        if current - since > self.history_size:
+            return False
+        with self._lock:
+            produced = set(self._versions.get(table_name, ()))
+        return all(version in produced for version in range(since + 1, current + 1))
+
+local_table_versions = LocalTableVersions()
+
+def create_table_versions(engine):
+    """
+    Adds the version rows of tables that have none. A new row starts at the
+    current time rather than at zero, so ETags handed out before the database
+    was recreated are never matched again.
+    """
+    try:
+        with engine.begin() as conn:
+            existing = set(conn.execute(select(TableVersion.table_name)).scalars().all())
+            missing = [table.name for table in SQLModel.metadata.sorted_tables if table.name not in existing]
+            if missing:
+                conn.execute(insert(TableVersion.__table__), [
+                    {"table_name": table_name, "version": int(time.time())} for table_name in missing
+                ])
+    except IntegrityError:
+        # Created concurrently by another worker starting up
+        pass
+
+def get_table_versions(session: Session, tables: Iterable[str]) -> Dict[str, int]:
+    rows = session.exec(
+        select(TableVersion.table_name, TableVersion.version).where(TableVersion.table_name.in_(list(tables)))
+    ).all()
+    return {table_name: version for table_name, version in rows}
+
+def table_versions_etag(session: Session, tables: List[str], variant: str = "") -> str:
+    """Weak ETag over the given tables; `variant` separates e.g. different query strings."""
+    versions = get_table_versions(session, tables)
+    current = ".".join(str(versions.get(table, 0)) for table in tables)
+    return f'W/"{current}.{zlib.crc32(variant.encode()):08x}"'
+
+def _changed_tables(session) -> set:
+    return session.info.setdefault("changed_tables", set())
+
+@event.listens_for(OrmSession, "after_flush")
+def _collect_flushed_tables(session, flush_context):
+    changed = _changed_tables(session)
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table_name = getattr(type(obj), "__tablename__", None)
+        if table_name:
+            changed.add(table_name)
+
+@event.listens_for(OrmSession, "do_orm_execute")
+def _collect_statement_tables(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        table = getattr(orm_execute_state.statement, "table", None)
+        if table is not None:
+            _changed_tables(orm_execute_state.session).add(table.name)
+
+@event.listens_for(OrmSession, "before_commit")
+def _bump_changed_tables(session):
+    # Pending objects are only flushed after this hook, so flush them first
+    session.flush()
+    changed = session.info.pop("changed_tables", None)
+    if not changed:
+        return
+    connection = session.connection()
+    bumped = session.info.setdefault("bumped_versions", {})
+    # One row at a time in name order, so concurrent writers lock the rows in the same order
+    for table_name in sorted(changed):
+        version = connection.execute(
+            update(TableVersion.__table__)
+            .where(TableVersion.__table__.c.table_name == table_name)
+            .values(version=TableVersion.__table__.c.version + 1)
+            .returning(TableVersion.__table__.c.version)
+        ).scalar()
+        if version is not None:
+            bumped[table_name] = version
+
+@event.listens_for(OrmSession, "after_commit")
+def _record_local_versions(session):
+    bumped = session.info.pop("bumped_versions", None)
+    if bumped:
+        local_table_versions.record(bumped)
+
+@event.listens_for(OrmSession, "after_rollback")
+def _discard_rolled_back_tables(session):
+    session.info.pop("changed_tables", None)
+    session.info.pop("bumped_versions", None)
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as required for If-None-Match
+    opaque = _strip_weak(etag)
+    return any(_strip_weak(tag.strip()) == opaque for tag in if_none_match.split(","))
+
+def _strip_weak(tag: str) -> str:
+    return tag[2:] if tag.startswith("W/") else tag
+
+def conditional_get(*models):
+    """
+    Route dependency answering If-None-Match with 304 from the table versions
+    alone, one primary key lookup, before the endpoint runs its query. Otherwise
+    it sets the ETag header. The versions are read before the endpoint loads its
+    data, so a write racing the request can only make the ETag older than the
+    body, never newer.
+    """
+    from database import get_session # database imports this module for create_table_versions
+
+    tables = [model.__tablename__ for model in models]
+
+    def dependency(request: Request, response: Response, session: Session = Depends(get_session)):
+        etag = table_versions_etag(session, tables, request.url.query)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            raise HTTPException(status_code=304, headers=headers)
+        response.headers.update(headers)
+
+    return dependency
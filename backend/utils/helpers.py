@@ -0,0 +1,38 @@
+import calendar
+from datetime import date, datetime, time, timedelta
+from typing import List, Optional, Tuple
+
+def day_bounds(day: date) -> Tuple[datetime, datetime]:
+    """Half-open [start, end) datetime range covering one calendar day."""
+    start = datetime.combine(day, time.min)
+    return start, start + timedelta(days=1)
+
+def date_range_bounds(date_from: Optional[date], date_to: Optional[date]) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """
+    Half-open [start, end) datetime range for an inclusive date range.
+    Either side may be None for an open-ended range.
+    """
+    start = datetime.combine(date_from, time.min) if date_from else None
+    end = datetime.combine(date_to + timedelta(days=1), time.min) if date_to else None
+    return start, end
+
+def add_months(day: date, months: int) -> date:
+    """The same day `months` months later (or earlier), clamped to the end of shorter months."""
+    month_index = day.year * 12 + day.month - 1 + months
+    year, month = divmod(month_index, 12)
+    return date(year, month + 1, min(day.day, calendar.monthrange(year, month + 1)[1]))
+
+def date_range_filter(column, date_from: Optional[date], date_to: Optional[date]) -> List:
+    """
+    WHERE predicates limiting a datetime column to an inclusive date range, as a
+    half-open [start, end) comparison on the bare column so an index on it can be
+    used; wrapping the column in date()/strftime() forces a full scan instead.
+    Either side may be None; an empty list means no restriction.
+    """
+    start, end = date_range_bounds(date_from, date_to)
+    conditions = []
+    if start:
+        conditions.append(column >= start)
+    if end:
+        conditions.append(column < end)
+    return conditions